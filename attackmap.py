@@ -0,0 +1,118 @@
+'''
+Attack maps kept up to date across moves.
+
+The squares attacked by the piece on every square are stored, and after a
+move only the squares that changed and the sliders looking through them are
+worked out again. A slider's attacks can only change if its old attacks
+reached one of the changed squares, so nothing else has to be looked at.
+The map of everything a color attacks is the OR of its pieces' attacks,
+made again only when asked for after a change, after which "is this square
+attacked" is a single bit test.
+
+Several moves can be caught up on at once: a slider whose attacks changed
+over them had a changed square inside its old attacks, the first blocker
+on a ray or a square in front of it, so the union of the changed squares
+is all update_moves needs.
+'''
+from bitboard import Position, KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN, EMPTY, MOVE_EN_PASSANT, MOVE_CASTLE, iter_bits
+from attacks import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, rook_attacks, bishop_attacks, queen_attacks
+
+
+def piece_attacks(code: int, square: int, occupied: int) -> int:
+    '''
+    Squares a piece with the given mailbox code attacks from square
+    '''
+    piece_type = code % 6
+    if piece_type == PAWN:
+        return PAWN_ATTACKS[code // 6][square]
+    if piece_type == KNIGHT:
+        return KNIGHT_ATTACKS[square]
+    if piece_type == KING:
+        return KING_ATTACKS[square]
+    if piece_type == BISHOP:
+        return bishop_attacks(square, occupied)
+    if piece_type == ROOK:
+        return rook_attacks(square, occupied)
+    return queen_attacks(square, occupied)
+
+def changed_squares(move: int) -> list[int]:
+    '''
+    Every square whose content a move changes, the same when it's made or taken back
+    '''
+    start = move & 63
+    target = move >> 6 & 63
+    flag = move >> 15 & 3
+    if flag == MOVE_EN_PASSANT:
+        return [start, target, (start & ~7) | (target & 7)]
+    if flag == MOVE_CASTLE:
+        if target & 7 == 6:
+            return [start, target, target + 1, target - 1]
+        return [start, target, target - 2, target + 1]
+    return [start, target]
+
+
+class AttackMap:
+    def __init__(self, position: Position) -> None:
+        self.position = position
+        self.attacks_from = [0] * 64
+        self.by_color = [0, 0]
+        self.stale = [True, True]
+        self.reset(position)
+
+    def reset(self, position: Position) -> None:
+        '''
+        Works everything out from scratch, for a position that didn't come from a move
+        '''
+        self.position = position
+        occupied = position.occupied
+        squares = position.squares
+        self.attacks_from = [piece_attacks(code, square, occupied) if code != EMPTY else 0
+                             for square, code in enumerate(squares)]
+        self.stale = [True, True]
+
+    def update(self, move: int) -> None:
+        '''
+        Brings the map up to date after move was made or taken back
+        '''
+        self.update_moves([move])
+
+    def update_moves(self, moves: 'list[int]') -> None:
+        '''
+        Brings the map up to date after all of moves were made or taken back,
+        in one pass over the squares any of them changed
+        '''
+        position = self.position
+        changed_mask = 0
+        for move in moves:
+            for square in changed_squares(move):
+                changed_mask |= 1 << square
+        changed = list(iter_bits(changed_mask))
+
+        occupied = position.occupied
+        squares = position.squares
+        attacks_from = self.attacks_from
+        pieces = position.pieces
+        sliders = (pieces[QUEEN] | pieces[ROOK] | pieces[BISHOP]) & ~changed_mask
+        for square in iter_bits(sliders):
+            if attacks_from[square] & changed_mask:
+                attacks_from[square] = piece_attacks(squares[square], square, occupied)
+        for square in changed:
+            code = squares[square]
+            attacks_from[square] = piece_attacks(code, square, occupied) if code != EMPTY else 0
+        self.stale = [True, True]
+
+    def attacked_by(self, color: int) -> int:
+        '''
+        Bitboard of every square color attacks
+        '''
+        if self.stale[color]:
+            attacks_from = self.attacks_from
+            attacked = 0
+            for square in iter_bits(self.position.colors[color]):
+                attacked |= attacks_from[square]
+            self.by_color[color] = attacked
+            self.stale[color] = False
+        return self.by_color[color]
+
+    def is_attacked(self, square: int, color: int) -> bool:
+        return bool(self.attacked_by(color) >> square & 1)
@@ -0,0 +1,100 @@
+'''
+Precomputed attack tables, using the square numbering from bitboard.py.
+
+Knights, kings and pawns get one attack word per square. Sliding pieces are
+split into their four lines (rank, file, diagonal and anti-diagonal) and each
+line has a table per square keyed by the occupancy of that line, so a rook or
+bishop lookup is two masks and two dictionary hits instead of a ray walk.
+Only the inner squares of a line go into the key, since a piece on the last
+square of a ray cannot block anything behind it.
+'''
+
+def _offset_table(offsets: 'tuple[tuple[int, int], ...]') -> list[int]:
+    table = []
+    for square in range(64):
+        x, y = square & 7, square >> 3
+        attacks = 0
+        for dx, dy in offsets:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx <= 7 and 0 <= ny <= 7:
+                attacks |= 1 << (ny * 8 + nx)
+        table.append(attacks)
+    return table
+
+def _ray(square: int, dx: int, dy: int, occupied: int) -> int:
+    x, y = (square & 7) + dx, (square >> 3) + dy
+    attacks = 0
+    while 0 <= x <= 7 and 0 <= y <= 7:
+        bit = 1 << (y * 8 + x)
+        attacks |= bit
+        if occupied & bit:
+            break
+        x += dx
+        y += dy
+    return attacks
+
+def _line_table(square: int, dx: int, dy: int) -> 'tuple[int, dict[int, int]]':
+    # both halves of the line through the square, without the last square of each half
+    inner = (_ray(square, dx, dy, 0) & ~_last_square(square, dx, dy)) | \
+            (_ray(square, -dx, -dy, 0) & ~_last_square(square, -dx, -dy))
+    table = {}
+    subset = 0
+    while True:
+        table[subset] = _ray(square, dx, dy, subset) | _ray(square, -dx, -dy, subset)
+        subset = (subset - inner) & inner
+        if subset == 0:
+            break
+    return inner, table
+
+def _last_square(square: int, dx: int, dy: int) -> int:
+    ray = _ray(square, dx, dy, 0)
+    if ray == 0:
+        return 0
+    # rays towards lower square numbers end on their lowest bit, the others on their highest
+    if dy * 8 + dx < 0:
+        return ray & -ray
+    return 1 << (ray.bit_length() - 1)
+
+
+KNIGHT_ATTACKS = _offset_table(((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, 2), (-1, -2), (1, 2), (1, -2)))
+KING_ATTACKS = _offset_table(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# indexed by the color of the pawn; white pawns (color 1) attack towards y = 0
+PAWN_ATTACKS = [_offset_table(((-1, 1), (1, 1))), _offset_table(((-1, -1), (1, -1)))]
+
+ROOK_LINES = [(_line_table(square, 1, 0), _line_table(square, 0, 1)) for square in range(64)]
+BISHOP_LINES = [(_line_table(square, 1, 1), _line_table(square, 1, -1)) for square in range(64)]
+
+
+def _line_tables() -> 'tuple[list[list[int]], list[list[int]]]':
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    directions = ((1, 0), (0, 1), (1, 1), (1, -1))
+    for square in range(64):
+        for dx, dy in directions:
+            full_line = _ray(square, dx, dy, 0) | _ray(square, -dx, -dy, 0) | (1 << square)
+            for sign in (1, -1):
+                squares_between = 0
+                x, y = (square & 7) + sign * dx, (square >> 3) + sign * dy
+                while 0 <= x <= 7 and 0 <= y <= 7:
+                    other = y * 8 + x
+                    between[square][other] = squares_between
+                    line[square][other] = full_line
+                    squares_between |= 1 << other
+                    x += sign * dx
+                    y += sign * dy
+    return between, line
+
+# squares strictly between two squares, and the whole line through them (0 if not on a line)
+BETWEEN, LINE = _line_tables()
+
+
+def rook_attacks(square: int, occupied: int) -> int:
+    (rank_mask, rank_table), (file_mask, file_table) = ROOK_LINES[square]
+    return rank_table[occupied & rank_mask] | file_table[occupied & file_mask]
+
+def bishop_attacks(square: int, occupied: int) -> int:
+    (diagonal_mask, diagonal_table), (anti_mask, anti_table) = BISHOP_LINES[square]
+    return diagonal_table[occupied & diagonal_mask] | anti_table[occupied & anti_mask]
+
+def queen_attacks(square: int, occupied: int) -> int:
+    return rook_attacks(square, occupied) | bishop_attacks(square, occupied)
@@ -0,0 +1,193 @@
+'''
+Streaming batch analysis of FEN/EPD files.
+
+Positions are read one line at a time, sent to a pool of worker processes in
+chunks, and written out as JSON lines in input order as soon as each chunk
+comes back. Only a few chunks per worker are in flight at once, so memory
+stays flat whatever the size of the input.
+
+    python batch.py positions.epd -o results.jsonl --workers 8 --depth 4
+    zcat dump.fen.gz | python batch.py - > results.jsonl
+'''
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional, TextIO
+from board import ChessParser
+from bitboard import move_name
+from movegen import generate_moves, checkers
+from search import Searcher, MATE, MAX_PLY
+from transposition import TranspositionTable
+
+CHUNK_SIZE = 256
+# chunks waiting for a worker or done but not written yet, per worker
+CHUNKS_IN_FLIGHT = 4
+
+# the searcher of the current process, made on first use
+_searcher: Optional[Searcher] = None
+
+
+def analyse_line(line: str, depth: int = 0, nodes: Optional[int] = None, hash_mb: float = 16) -> dict:
+    '''
+    Analyses one FEN or EPD line: legal move count, check, checkmate and
+    stalemate, plus the best move and score when depth or nodes is given
+    '''
+    global _searcher
+    try:
+        position, operations = ChessParser.TranslateEpd(line)
+    except ValueError as error:
+        return {'error': str(error)}
+
+    moves = generate_moves(position)
+    in_check = bool(checkers(position))
+    result = {
+        'fen': ChessParser.ToFen(position),
+        'legal_moves': len(moves),
+        'check': in_check,
+        'checkmate': in_check and not moves,
+        'stalemate': not in_check and not moves,
+    }
+    if 'id' in operations:
+        result['id'] = operations['id']
+
+    if moves and (depth or nodes):
+        if _searcher is None:
+            _searcher = Searcher(TranspositionTable(hash_mb))
+        found = _searcher.search(position, depth or MAX_PLY, node_limit=nodes)
+        result['bestmove'] = move_name(found.best_move)
+        result['score'] = found.score
+        result['depth'] = found.depth
+        if abs(found.score) >= MATE - MAX_PLY:
+            # moves to mate, negative when the side to move is getting mated
+            plies = MATE - abs(found.score)
+            result['mate'] = (plies + 1) // 2 if found.score > 0 else -(plies // 2)
+    return result
+
+def analyse_chunk(lines: 'list[tuple[int, str]]', depth: int, nodes: Optional[int], hash_mb: float) -> list[str]:
+    if not depth and not nodes:
+        return analyse_chunk_vectorized(lines)
+    output = []
+    for line_number, line in lines:
+        result = {'line': line_number}
+        result.update(analyse_line(line, depth, nodes, hash_mb))
+        output.append(json.dumps(result))
+    return output
+
+def analyse_chunk_vectorized(lines: 'list[tuple[int, str]]') -> list[str]:
+    '''
+    Same output as analyse_chunk without a search, with the move counts and
+    checks of the whole chunk worked out at once by vectorized.py
+    '''
+    from vectorized import stack, legal_move_counts, in_check
+
+    parsed = []
+    results = []
+    for line_number, line in lines:
+        result = {'line': line_number}
+        try:
+            position, operations = ChessParser.TranslateEpd(line)
+        except ValueError as error:
+            result['error'] = str(error)
+        else:
+            result['fen'] = ChessParser.ToFen(position)
+            parsed.append((result, position, operations))
+        results.append(result)
+
+    if parsed:
+        batch = stack(position for _, position, _ in parsed)
+        counts, checks = legal_move_counts(batch), in_check(batch)
+        for (result, _, operations), count, check in zip(parsed, counts.tolist(), checks.tolist()):
+            result['legal_moves'] = count
+            result['check'] = check
+            result['checkmate'] = check and not count
+            result['stalemate'] = not check and not count
+            if 'id' in operations:
+                result['id'] = operations['id']
+    return [json.dumps(result) for result in results]
+
+def read_lines(source: TextIO) -> 'Iterator[tuple[int, str]]':
+    '''
+    Numbered position lines of a file, without blank lines and # comments
+    '''
+    for line_number, line in enumerate(source, 1):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line_number, line
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def stream_results(function: 'Callable[..., list[str]]', chunks: Iterable[list], out: TextIO,
+                   workers: int = 1, *args) -> int:
+    '''
+    Calls function(chunk, *args) for every chunk, on a process pool when
+    there's more than one worker, and writes the lines it returns to out in
+    chunk order. Returns the number of lines written.
+    '''
+    written = 0
+    if workers <= 1:
+        for chunk in chunks:
+            written += _write(function(chunk, *args), out)
+        return written
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(function, chunk, *args))
+            # wait on the oldest chunk once enough are queued, this keeps the output in input order
+            while len(pending) >= workers * CHUNKS_IN_FLIGHT:
+                written += _write(pending.popleft().result(), out)
+        while pending:
+            written += _write(pending.popleft().result(), out)
+    return written
+
+def run(source: TextIO, out: TextIO, workers: int = 1, depth: int = 0, nodes: Optional[int] = None,
+        hash_mb: float = 16, chunk_size: int = CHUNK_SIZE) -> int:
+    '''
+    Analyses every position of source and writes one JSON line per position
+    to out, returns how many positions were written
+    '''
+    chunks = chunked(read_lines(source), chunk_size)
+    return stream_results(analyse_chunk, chunks, out, workers, depth, nodes, hash_mb)
+
+def _write(lines: list[str], out: TextIO) -> int:
+    if not lines:
+        return 0
+    out.write('\n'.join(lines) + '\n')
+    out.flush()
+    return len(lines)
+
+def main(argv: 'list[str] | None' = None) -> int:
+    parser = argparse.ArgumentParser(description='Analyse every position of a FEN or EPD file.')
+    parser.add_argument('input', help='file with one FEN or EPD per line, - for stdin')
+    parser.add_argument('-o', '--output', default='-', help='JSON lines output file, - for stdout')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('-d', '--depth', type=int, default=0, help='search depth for a best move (0 for none)')
+    parser.add_argument('-n', '--nodes', type=int, default=None, help='search nodes for a best move')
+    parser.add_argument('--hash', type=float, default=16, help='transposition table size in MB, per worker')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == '-' else open(args.input)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        count = run(source, out, args.workers, args.depth, args.nodes, args.hash, args.chunk_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    print(f'{count} positions analysed', file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,401 @@
+'''
+Compact bitboard representation of a chess position.
+
+Squares are numbered in the same order the board is drawn and a FEN is read,
+square = y * 8 + x for a position [x, y], so a8 is 0 and h1 is 63.
+Colors and piece types use the same numbers as pieces.py:
+color 0 is black and 1 is white, piece types follow 'kqrbnp'.
+
+Position.snapshot packs a position into a fixed-size struct and
+Position.from_snapshot reads it back, which is much quicker than parsing a
+FEN and needs no pickle.
+'''
+import struct
+from typing import Iterator, Optional
+from zobrist import PIECE_KEYS, CASTLING_KEYS, EN_PASSANT_KEYS, BLACK_TO_MOVE_KEY
+from pst import PST_MG, PST_EG
+from attacks import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, rook_attacks, bishop_attacks
+
+KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN = range(6)
+PIECE_CHARS = 'kqrbnp'
+EMPTY = -1
+
+# castling rights
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+CASTLING_CHARS = 'KQkq'
+
+# moves are packed into an int: start | target << 6 | promotion << 12 | flag << 15,
+# where promotion is the piece type promoted to (0 for none, a king can't be promoted to)
+MOVE_NORMAL = 0
+MOVE_DOUBLE_PUSH = 1
+MOVE_EN_PASSANT = 2
+MOVE_CASTLE = 3
+
+SNAPSHOT_VERSION = 2
+# version, the 12 bitboards by color * 6 + piece_type, turn, castling, en passant, halfmove, fullmove;
+# the key and evaluation sums are worked out again on loading, so they never go stale,
+# and the move history isn't kept, same as in a FEN
+SNAPSHOT = struct.Struct('<B12QBBbqq')
+
+
+def square_name(square: int) -> str:
+    return 'abcdefgh'[square & 7] + str(8 - (square >> 3))
+
+def parse_square(name: str) -> int:
+    return (8 - int(name[1])) * 8 + 'abcdefgh'.index(name[0])
+
+def encode_move(start: int, target: int, promotion: int = 0, flag: int = MOVE_NORMAL) -> int:
+    return start | target << 6 | promotion << 12 | flag << 15
+
+def move_start(move: int) -> int:
+    return move & 63
+
+def move_target(move: int) -> int:
+    return move >> 6 & 63
+
+def move_promotion(move: int) -> int:
+    return move >> 12 & 7
+
+def move_flag(move: int) -> int:
+    return move >> 15 & 3
+
+def move_name(move: int) -> str:
+    '''
+    Long algebraic name of a move, like e2e4 or e7e8q
+    '''
+    promotion = move >> 12 & 7
+    name = square_name(move & 63) + square_name(move >> 6 & 63)
+    return name + PIECE_CHARS[promotion] if promotion else name
+
+def iter_bits(bitboard: int) -> Iterator[int]:
+    while bitboard:
+        lowest = bitboard & -bitboard
+        yield lowest.bit_length() - 1
+        bitboard ^= lowest
+
+def lsb(bitboard: int) -> int:
+    return (bitboard & -bitboard).bit_length() - 1
+
+
+class Position:
+    '''
+    Occupancy words per color and per piece type, plus a 64 entry mailbox
+    so "what is on this square" is a single index instead of a scan.
+    '''
+    def __init__(self) -> None:
+        self.colors: list[int] = [0, 0]
+        self.pieces: list[int] = [0] * 6
+        # color * 6 + piece_type for every square, EMPTY if nothing is there
+        self.squares: list[int] = [EMPTY] * 64
+        self.turn: int = 1
+        self.castling: int = 0
+        self.en_passant: int = EMPTY
+        self.halfmove: int = 0
+        self.fullmove: int = 1
+        # zobrist key, kept up to date by every change to the position
+        self.key: int = 0
+        # material and piece-square sums from white's side, for the middlegame and the endgame, kept up to date the same way
+        self.mg: int = 0
+        self.eg: int = 0
+        # one (move, captured, castling, en_passant, halfmove, key) entry per move made
+        self.history: 'list[tuple[int, int, int, int, int, int]]' = []
+
+    @property
+    def occupied(self) -> int:
+        return self.colors[0] | self.colors[1]
+
+    def put_piece(self, square: int, code: int) -> None:
+        bit = 1 << square
+        self.colors[code // 6] |= bit
+        self.pieces[code % 6] |= bit
+        self.squares[square] = code
+        self.key ^= PIECE_KEYS[code][square]
+        self.mg += PST_MG[code][square]
+        self.eg += PST_EG[code][square]
+
+    def remove_piece(self, square: int) -> int:
+        code = self.squares[square]
+        if code == EMPTY:
+            return EMPTY
+        mask = ~(1 << square)
+        self.colors[code // 6] &= mask
+        self.pieces[code % 6] &= mask
+        self.squares[square] = EMPTY
+        self.key ^= PIECE_KEYS[code][square]
+        self.mg -= PST_MG[code][square]
+        self.eg -= PST_EG[code][square]
+        return code
+
+    def move_piece(self, start: int, target: int) -> None:
+        code = self.squares[start]
+        swap = (1 << start) | (1 << target)
+        self.colors[code // 6] ^= swap
+        self.pieces[code % 6] ^= swap
+        self.squares[start] = EMPTY
+        self.squares[target] = code
+        keys = PIECE_KEYS[code]
+        self.key ^= keys[start] ^ keys[target]
+        mg = PST_MG[code]
+        eg = PST_EG[code]
+        self.mg += mg[target] - mg[start]
+        self.eg += eg[target] - eg[start]
+
+    def is_empty(self, square: int) -> bool:
+        return self.squares[square] == EMPTY
+
+    def pieces_of(self, color: int, piece_type: int) -> int:
+        return self.colors[color] & self.pieces[piece_type]
+
+    def king_square(self, color: int) -> Optional[int]:
+        king = self.colors[color] & self.pieces[KING]
+        return lsb(king) if king else None
+
+    def copy(self) -> 'Position':
+        position = Position.__new__(Position)
+        position.colors = self.colors[:]
+        position.pieces = self.pieces[:]
+        position.squares = self.squares[:]
+        position.turn = self.turn
+        position.castling = self.castling
+        position.en_passant = self.en_passant
+        position.halfmove = self.halfmove
+        position.fullmove = self.fullmove
+        position.key = self.key
+        position.mg = self.mg
+        position.eg = self.eg
+        position.history = self.history[:]
+        return position
+
+    def snapshot(self) -> bytes:
+        '''
+        The position as SNAPSHOT.size bytes, see from_snapshot
+        '''
+        colors, pieces = self.colors, self.pieces
+        boards = (colors[color] & pieces[piece_type] for color in range(2) for piece_type in range(6))
+        try:
+            return SNAPSHOT.pack(SNAPSHOT_VERSION, *boards, self.turn, self.castling, self.en_passant,
+                                 self.halfmove, self.fullmove)
+        except struct.error as error:
+            raise ValueError(f'Position does not fit in a snapshot: {error}') from None
+
+    @staticmethod
+    def from_snapshot(data: bytes) -> 'Position':
+        '''
+        Reads the bytes of snapshot back, a ValueError is raised for anything snapshot can't have made
+        '''
+        try:
+            version, *boards, turn, castling, en_passant, halfmove, fullmove = SNAPSHOT.unpack(data)
+        except struct.error as error:
+            raise ValueError(f'Invalid snapshot: {error}') from None
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f'Invalid snapshot: version {version}')
+        if turn not in (0, 1) or castling > 15 or not EMPTY <= en_passant <= 63:
+            raise ValueError(f'Invalid snapshot: turn {turn}, castling {castling}, en passant {en_passant}')
+        if boards[KING].bit_count() != 1 or boards[6 + KING].bit_count() != 1:
+            raise ValueError('Invalid snapshot: each side needs exactly one king')
+        position = Position()
+        for code, bitboard in enumerate(boards):
+            for square in iter_bits(bitboard):
+                if position.squares[square] != EMPTY:
+                    raise ValueError('Invalid snapshot: two pieces on one square')
+                position.put_piece(square, code)
+        position.turn = turn
+        position.castling = castling
+        position.en_passant = en_passant
+        position.halfmove = halfmove
+        position.fullmove = fullmove
+        # the same rules ChessParser.TranslateFen keeps a FEN to
+        if allowed_castling(position) != castling:
+            raise ValueError(f'Invalid snapshot: castling {castling} without the king and rook on their squares')
+        if en_passant != EMPTY and allowed_en_passant(position, en_passant) != en_passant:
+            raise ValueError(f'Invalid snapshot: no en passant capture on {en_passant}')
+        if halfmove < 0 or fullmove < 0:
+            raise ValueError(f'Invalid snapshot: clocks {halfmove} {fullmove}')
+        position.key = position.compute_key()
+        return position
+
+    def compute_key(self) -> int:
+        '''
+        Zobrist key of the position worked out from scratch, make_move keeps
+        self.key equal to this without recomputing it
+        '''
+        key = 0
+        for square, code in enumerate(self.squares):
+            if code != EMPTY:
+                key ^= PIECE_KEYS[code][square]
+        key ^= CASTLING_KEYS[self.castling]
+        if self.en_passant != EMPTY:
+            key ^= EN_PASSANT_KEYS[self.en_passant & 7]
+        if self.turn == 0:
+            key ^= BLACK_TO_MOVE_KEY
+        return key
+
+    def make_move(self, move: int) -> None:
+        '''
+        Plays a packed move (see encode_move), which has to be legal in this position,
+        and keeps what is needed to take it back with unmake_move
+        '''
+        start = move & 63
+        target = move >> 6 & 63
+        promotion = move >> 12 & 7
+        flag = move >> 15 & 3
+        us = self.turn
+        key = self.key
+
+        if flag == MOVE_EN_PASSANT:
+            # the pawn being taken is beside the capturing pawn, behind the target square
+            captured = self.remove_piece(target + 8 if us == 1 else target - 8)
+        else:
+            captured = self.remove_piece(target)
+
+        self.history.append((move, captured, self.castling, self.en_passant, self.halfmove, key))
+
+        moving = self.squares[start]
+        self.move_piece(start, target)
+        if flag == MOVE_CASTLE:
+            # move-rookinator, the rook jumps over the king
+            if target & 7 == 6:
+                self.move_piece(target + 1, target - 1)
+            else:
+                self.move_piece(target - 2, target + 1)
+        elif promotion:
+            self.remove_piece(target)
+            self.put_piece(target, us * 6 + promotion)
+
+        # the piece moves above already updated the key, the rest is xored out and back in here
+        key = self.key ^ CASTLING_KEYS[self.castling] ^ BLACK_TO_MOVE_KEY
+        if self.en_passant != EMPTY:
+            key ^= EN_PASSANT_KEYS[self.en_passant & 7]
+
+        self.castling &= CASTLING_MASKS[start] & CASTLING_MASKS[target]
+        key ^= CASTLING_KEYS[self.castling]
+
+        # en passant is only kept when a pawn can actually take it
+        self.en_passant = EMPTY
+        if flag == MOVE_DOUBLE_PUSH:
+            passed = (start + target) // 2
+            if PAWN_ATTACKS[us][passed] & self.pieces[PAWN] & self.colors[1 - us]:
+                self.en_passant = passed
+                key ^= EN_PASSANT_KEYS[passed & 7]
+        self.key = key
+
+        if captured != EMPTY or moving % 6 == PAWN:
+            self.halfmove = 0
+        else:
+            self.halfmove += 1
+        if us == 0:
+            self.fullmove += 1
+        self.turn = 1 - us
+
+    def unmake_move(self) -> int:
+        '''
+        Takes back the last move made and returns it
+        '''
+        move, captured, self.castling, self.en_passant, self.halfmove, key = self.history.pop()
+        start = move & 63
+        target = move >> 6 & 63
+        flag = move >> 15 & 3
+        us = 1 - self.turn
+        self.turn = us
+        if us == 0:
+            self.fullmove -= 1
+
+        if move >> 12 & 7:
+            self.remove_piece(target)
+            self.put_piece(target, us * 6 + PAWN)
+        elif flag == MOVE_CASTLE:
+            if target & 7 == 6:
+                self.move_piece(target - 1, target + 1)
+            else:
+                self.move_piece(target + 1, target - 2)
+        self.move_piece(target, start)
+
+        if captured != EMPTY:
+            if flag == MOVE_EN_PASSANT:
+                self.put_piece(target + 8 if us == 1 else target - 8, captured)
+            else:
+                self.put_piece(target, captured)
+        # the piece moves above undid their own part of the key, this also restores the rest
+        self.key = key
+        return move
+
+    def is_square_attacked(self, square: int, attacker_color: int) -> bool:
+        '''
+        Looks outwards from the square with the attack tables, a pawn of the
+        defending color on the square attacks exactly where an attacking pawn
+        would have to stand.
+        '''
+        pieces = self.pieces
+        them = self.colors[attacker_color]
+        if PAWN_ATTACKS[1 - attacker_color][square] & pieces[PAWN] & them:
+            return True
+        if KNIGHT_ATTACKS[square] & pieces[KNIGHT] & them:
+            return True
+        if KING_ATTACKS[square] & pieces[KING] & them:
+            return True
+        occupied = self.colors[0] | self.colors[1]
+        queens = pieces[QUEEN]
+        if rook_attacks(square, occupied) & (pieces[ROOK] | queens) & them:
+            return True
+        return bool(bishop_attacks(square, occupied) & (pieces[BISHOP] | queens) & them)
+
+    def attackers_to(self, square: int, occupied: int) -> int:
+        '''
+        Every piece of either color attacking the square, with sliders seen
+        through the given occupancy
+        '''
+        pieces = self.pieces
+        queens = pieces[QUEEN]
+        return (PAWN_ATTACKS[0][square] & pieces[PAWN] & self.colors[1]) | \
+               (PAWN_ATTACKS[1][square] & pieces[PAWN] & self.colors[0]) | \
+               (KNIGHT_ATTACKS[square] & pieces[KNIGHT]) | \
+               (KING_ATTACKS[square] & pieces[KING]) | \
+               (rook_attacks(square, occupied) & (pieces[ROOK] | queens)) | \
+               (bishop_attacks(square, occupied) & (pieces[BISHOP] | queens))
+
+
+# castling rights that survive a move touching the square (king or rook squares)
+CASTLING_MASKS = [15] * 64
+CASTLING_MASKS[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASKS[63] = 15 & ~WHITE_KINGSIDE
+CASTLING_MASKS[56] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASKS[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASKS[7] = 15 & ~BLACK_KINGSIDE
+CASTLING_MASKS[0] = 15 & ~BLACK_QUEENSIDE
+
+# (bit of the right in CASTLING_CHARS order, king square, rook square)
+CASTLING_SQUARES = ((0, 60, 63), (1, 60, 56), (2, 4, 7), (3, 4, 0))
+KING_CODES = (6 + KING, 6 + KING, KING, KING)
+ROOK_CODES = (6 + ROOK, 6 + ROOK, ROOK, ROOK)
+# by side to move, the rank an en passant square is on: behind a pawn the other side just pushed
+EN_PASSANT_RANKS = (0xFF << 40, 0xFF << 16)
+
+
+def allowed_castling(position: Position) -> int:
+    '''
+    The castling rights of position whose king and rook are still on their squares
+    '''
+    castling = position.castling
+    for right, king, rook in CASTLING_SQUARES:
+        if position.squares[king] != KING_CODES[right] or position.squares[rook] != ROOK_CODES[right]:
+            castling &= ~(1 << right)
+    return castling
+
+def allowed_en_passant(position: Position, square: int) -> int:
+    '''
+    square if the side to move can take en passant there, EMPTY otherwise; like
+    make_move, a square no pawn can take on is dropped so equal positions get equal keys
+    '''
+    us = position.turn
+    if square == EMPTY or not EN_PASSANT_RANKS[us] >> square & 1 or position.squares[square] != EMPTY:
+        return EMPTY
+    # the pawn that was just pushed two squares stands in front of it
+    pushed = square + 8 if us == 1 else square - 8
+    if position.squares[pushed] != (1 - us) * 6 + PAWN:
+        return EMPTY
+    if not position.pieces_of(us, PAWN) & PAWN_ATTACKS[1 - us][square]:
+        return EMPTY
+    return square
@@ -1,98 +1,161 @@
-import pygame
 from typing import Optional
-from constants import WHITE, BLACK, SQUARE_SIZE, SELECTED_WHITE, SELECTED_BLACK
 from pieces import *
+from bitboard import (Position, EMPTY, KING, QUEEN, ROOK, PAWN, PIECE_CHARS, CASTLING_CHARS,
+                      square_name, parse_square, move_target, move_promotion, allowed_castling, allowed_en_passant)
+from attackmap import AttackMap
+from movecache import MoveCache
+from profiling import profiled
+from gamestate import GameStatus, game_status, position_counts
+
+# moves the attack map is left behind by before it's worked out again from scratch instead of caught up on
+MAX_UNSYNCED_MOVES = 32
 
 class Board:
-    def __init__(self, win:pygame.surface, images: list[list[pygame.Surface]]):
-        self.board:'list[Piece]' = []
-        self.WIN = win
-        self.IMAGES = images
-        self.graphical_board:'list[pygame.Rect]' = [
-            pygame.Rect(i * SQUARE_SIZE, j * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE) 
-            for i in range(8) for j in range(8)
-            ]
-    
-    def DrawBoard(self) -> None:
-        for rank in range(8):
-            for file in range(8):
-                square_color = WHITE if (rank + file) % 2 == 0 else BLACK
-                pygame.draw.rect(self.WIN, square_color, self.graphical_board[rank + 8 * file])
+    def __init__(self, move_cache:Optional[MoveCache] = None) -> None:
+        self.position = Position()
+        # what each color attacks, caught up on the moves made or taken back since it was last asked,
+        # so playing moves costs nothing until something wants to know what is attacked
+        self.attack_map = AttackMap(self.position)
+        # None once there are too many to catch up on
+        self.unsynced_moves:'Optional[list[int]]' = []
+        # legal moves per position key, shared by highlighting, move checking and game over,
+        # boards can share one cache as the key covers the whole position
+        self.move_cache = move_cache if move_cache is not None else MoveCache()
+        # how often each position key came up in this game, for threefold repetition
+        self.key_counts = position_counts(self.position)
+        # view of self.position used for drawing and picking pieces with the mouse,
+        # only rebuilt when it's asked for after the position changed
+        self.pieces:'list[Piece]' = []
+        self.pieces_by_square:'dict[int, Piece]' = {}
+        self.pieces_stale = False
     
-    def DrawPieces(self) -> None:
-        '''
-        Let's you draw every piece in the board, and letting the image 
-        '''
-        piece:Piece
-        for piece in self.board:
-            self.WIN.blit(self.IMAGES[1 - piece.color][piece.piece_type], piece.rect)
+    @property
+    def board(self) -> 'list[Piece]':
+        if self.pieces_stale:
+            self.UpdatePieces()
+        return self.pieces
 
-    def DrawSelectedSquares(self, legal_moves:list[list[int]]) -> None:
-        if legal_moves == []:
-            return
-        for position in legal_moves:
-            file, rank = position
-            square = self.graphical_board[rank + 8 * file]
-            square_color = SELECTED_WHITE if ((file + rank) % 2 == 0 ) else SELECTED_BLACK
-            pygame.draw.rect(self.WIN, square_color, square)
-    
-    def FindKing(self, color:int) -> Optional[list[int]]:
-        for piece in self.board:
-            if isinstance(piece, King) and piece.color == color:
-                return piece.position
-        
-        return None
+    def FindKing(self, color:int) -> Optional[int]:
+        return self.position.king_square(color)
+
+    def IsSquareAttacked(self, square:int, attacker_color:int) -> bool:
+        return self.Attacks().is_attacked(square, attacker_color)
 
-    def IsSquareAttacked(self, square:list[int], attacker_color:int) -> bool:
-        for piece in self.board:
-            if piece.color == attacker_color:
-                legal_moves = MoveManager.AttackedSquares(piece, self)
-                if square in legal_moves:
-                    return True
-        return False
+    def Attacks(self) -> AttackMap:
+        '''
+        The attack map, brought up to date with the position
+        '''
+        if self.unsynced_moves is None:
+            self.attack_map.reset(self.position)
+            self.unsynced_moves = []
+        elif self.unsynced_moves:
+            self.attack_map.update_moves(self.unsynced_moves)
+            self.unsynced_moves = []
+        return self.attack_map
+
+    def _AddUnsynced(self, move:int) -> None:
+        if self.unsynced_moves is not None:
+            self.unsynced_moves.append(move)
+            if len(self.unsynced_moves) > MAX_UNSYNCED_MOVES:
+                self.unsynced_moves = None
     
-    def IsEmpty(self, position:list[int]) -> bool:
-        for piece in self.board:
-            if piece.position == position:
-                return False
-        return True
+    def IsEmpty(self, square:int) -> bool:
+        return self.position.is_empty(square)
 
+    @profiled('board.check')
     def IsKingInCheck(self, color:int) -> bool:
-        king_position = self.FindKing(color)
-        opponent_color = 1- color
-        return self.IsSquareAttacked(king_position, opponent_color)
+        king_square = self.position.king_square(color)
+        if king_square is None:
+            return False
+        return self.Attacks().is_attacked(king_square, 1 - color)
     
+    @profiled('board.checkmate')
     def IsCheckmate(self, color:int) -> bool:
-        # Check if the opponent's king is in check
-        if not self.IsKingInCheck(color):
+        # only the side to move can be checkmated
+        if color != self.position.turn or not self.IsKingInCheck(color):
             return False
 
-        # Generate legal moves for all opponent's pieces
-        for piece in self.board:
-            if piece.color != color:
-                continue
+        # If no legal move can remove the check, it's checkmate
+        return not self.GenerateMoves()
 
-            legal_moves = MoveManager.LegalMoves(piece, self)
-            original_position = piece.position[:]
+    def GenerateMoves(self) -> list[int]:
+        '''
+        Every legal move of the side to move, packed as in bitboard.encode_move,
+        the list is shared with the move cache so it must not be modified
+        '''
+        return self.move_cache.get(self.position)
 
-            # Test each move
-            for move in legal_moves:
-                # Apply the move temporarily
-                piece.position = move
+    @property
+    def key(self) -> int:
+        '''
+        64 bit zobrist key of the position, equal positions have equal keys
+        '''
+        return self.position.key
 
-                # If the opponent's king is not in check after the move, it's not checkmate
-                if not self.IsKingInCheck(color):
-                    piece.position = original_position
-                    return False
+    def make_move(self, move:int) -> None:
+        '''
+        Plays a packed move from GenerateMoves, it can be taken back with unmake_move
+        '''
+        self.position.make_move(move)
+        self._AddUnsynced(move)
+        self.move_cache.prefetch(self.position)
+        self.key_counts[self.position.key] += 1
+        self.pieces_stale = True
+
+    def unmake_move(self) -> int:
+        key = self.position.key
+        move = self.position.unmake_move()
+        self._AddUnsynced(move)
+        self.key_counts[key] -= 1
+        if not self.key_counts[key]:
+            del self.key_counts[key]
+        self.pieces_stale = True
+        return move
+
+    @profiled('board.status')
+    def Status(self) -> GameStatus:
+        '''
+        Whether the game is over and why, see gamestate.game_status
+        '''
+        return game_status(self.position, self.key_counts, self.GenerateMoves(),
+                           self.IsKingInCheck(self.position.turn))
 
-                # Revert the move
-                piece.position = original_position
+    def TranslateFen(self, fen:str) -> None:
+        self.SetPosition(ChessParser.TranslateFen(fen))
 
-        # If no legal move can remove the check, it's checkmate
-        return True
+    def LoadSnapshot(self, data:bytes) -> None:
+        '''
+        Sets the board up from the bytes of Position.snapshot, without parsing a FEN
+        '''
+        self.SetPosition(Position.from_snapshot(data))
 
-    def TranslateFen(self, fen:str) -> None:
-        self.board = ChessParser.TranslateFen(fen)
+    def SetPosition(self, position:'Position') -> None:
+        self.position = position
+        self.key_counts = position_counts(self.position)
+        self.attack_map.reset(self.position)
+        self.unsynced_moves = []
+        self.move_cache.prefetch(self.position)
+        # the piece view is only built when something draws or picks a piece
+        self.pieces_stale = True
+
+    def ToFen(self) -> str:
+        return ChessParser.ToFen(self.position)
+
+    def Snapshot(self) -> bytes:
+        return self.position.snapshot()
+
+    def UpdatePieces(self) -> None:
+        '''
+        Rebuilds the piece view from the position after it changed
+        '''
+        self.pieces = ChessParser.CreatePieces(self.position)
+        self.pieces_by_square = {piece.square: piece for piece in self.pieces}
+        self.pieces_stale = False
+
+    def PieceAt(self, square:int) -> 'Optional[Piece]':
+        if self.pieces_stale:
+            self.UpdatePieces()
+        return self.pieces_by_square.get(square)
 
 
 class ChessParser:
@@ -101,206 +164,205 @@ class ChessParser:
     so given a FEN, all the pieces are created and set-up in the right space
     """
     @staticmethod
-    def TranslateFen(fen:str) -> 'list[Piece]':
+    def TranslateFen(fen:str) -> 'Position':
         '''
-        Translates the first part of a FEN into the initial conditions 
-        of the board, letting you have more flexibility
+        Translates a FEN into the initial conditions of the board
+        (pieces, side to move, castling rights, en passant square and clocks).
+        The clocks can be left out, as in EPD, and a ValueError is raised for
+        anything that isn't a valid FEN.
         '''
-        pieces = []
-        position = [0, 0]
-        for character in fen:
-            if character == '/':
-                position[0] = 0
-                position[1] += 1
-                continue
+        fields = fen.split()
+        if not 1 <= len(fields) <= 6:
+            raise ValueError(f'expected 6 FEN fields, got {len(fields)}: {fen!r}')
+        position = ChessParser._TranslatePlacement(fields[0])
+
+        if len(fields) > 1:
+            if fields[1] not in ('w', 'b'):
+                raise ValueError(f'side to move must be w or b, got {fields[1]!r}')
+            position.turn = 0 if (fields[1] == 'b') else 1
+
+        if len(fields) > 2 and fields[2] != '-':
+            for character in fields[2]:
+                if character not in CASTLING_CHARS:
+                    raise ValueError(f'invalid castling rights {fields[2]!r}')
+                position.castling |= 1 << CASTLING_CHARS.index(character)
+            # rights are only kept while the king and rook are still on their squares
+            position.castling = allowed_castling(position)
+
+        if len(fields) > 3 and fields[3] != '-':
+            en_passant = fields[3]
+            if len(en_passant) != 2 or en_passant[0] not in 'abcdefgh' or en_passant[1] not in '36':
+                raise ValueError(f'invalid en passant square {en_passant!r}')
+            position.en_passant = allowed_en_passant(position, parse_square(en_passant))
+
+        if len(fields) > 5:
+            # counts, so never negative
+            if not (fields[4].isdecimal() and fields[5].isdecimal()):
+                raise ValueError(f'invalid move clocks {fields[4]!r} {fields[5]!r}')
+            position.halfmove = int(fields[4])
+            position.fullmove = int(fields[5])
+        elif len(fields) == 5:
+            raise ValueError(f'expected both move clocks: {fen!r}')
+
+        position.key = position.compute_key()
+        return position
 
-            elif character.lower() in 'kqrbnp':
-                color = 0 if (character == character.lower()) else 1
-                piece = ChessParser.create_piece(color, character.lower(), position[:])
-                if piece is not None:
-                    pieces.append(piece)
-                    position[0] += 1
-                continue
+    @staticmethod
+    def _TranslatePlacement(placement:str) -> 'Position':
+        position = Position()
+        ranks = placement.split('/')
+        if len(ranks) != 8:
+            raise ValueError(f'expected 8 ranks, got {len(ranks)}: {placement!r}')
+        for y, rank in enumerate(ranks):
+            x = 0
+            for character in rank:
+                if x >= 8:
+                    raise ValueError(f'rank {8 - y} has more than 8 squares: {rank!r}')
+                if character.lower() in PIECE_CHARS:
+                    color = 0 if (character == character.lower()) else 1
+                    position.put_piece(y * 8 + x, color * 6 + PIECE_CHARS.index(character.lower()))
+                    x += 1
+                elif character in '12345678':
+                    x += int(character)
+                else:
+                    raise ValueError(f'invalid character {character!r} in {placement!r}')
+            if x != 8:
+                raise ValueError(f'rank {8 - y} does not have 8 squares: {rank!r}')
+
+        for color in (0, 1):
+            if position.pieces_of(color, KING).bit_count() != 1:
+                raise ValueError(f'each side needs exactly one king: {placement!r}')
+        return position
 
-            elif character in '12345678':
-                position[0] += int(character)
+    @staticmethod
+    def TranslateEpd(epd:str) -> 'tuple[Position, dict[str, str]]':
+        '''
+        Translates an EPD line, the four position fields of a FEN followed by
+        operations like "bm Nf3; id \"test 1\";", into a position and its operations
+        '''
+        fields = epd.split(None, 4)
+        if len(fields) < 4:
+            raise ValueError(f'expected at least 4 EPD fields: {epd!r}')
+        operations = {}
+        fen = ' '.join(fields[:4])
+        rest = fields[4] if len(fields) > 4 else ''
+        # a full FEN is accepted too, with or without operations after its clocks,
+        # an opcode starts with a letter so a leading number can only be a clock
+        clocks = rest.split(None, 2)
+        if clocks and clocks[0].isdigit():
+            if len(clocks) < 2 or not clocks[1].isdigit():
+                raise ValueError(f'expected both move clocks: {epd!r}')
+            fen += f' {clocks[0]} {clocks[1]}'
+            rest = clocks[2] if len(clocks) > 2 else ''
+
+        for operation in rest.split(';'):
+            operation = operation.strip()
+            if not operation:
+                continue
+            opcode, _, operand = operation.partition(' ')
+            operations[opcode] = operand.strip().strip('"')
+        position = ChessParser.TranslateFen(fen)
+        if 'hmvc' in operations:
+            position.halfmove = int(operations['hmvc'])
+        if 'fmvn' in operations:
+            position.fullmove = int(operations['fmvn'])
+        return position, operations
 
-            elif character in 'wb':
-                MoveManager.turn = 0 if (character == 'b') else 1
+    @staticmethod
+    def ToFen(position:'Position') -> str:
+        ranks = []
+        for y in range(8):
+            rank = ''
+            empty = 0
+            for x in range(8):
+                code = position.squares[y * 8 + x]
+                if code == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                character = PIECE_CHARS[code % 6]
+                rank += character.upper() if code // 6 == 1 else character
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+
+        castling = ''.join(character for index, character in enumerate(CASTLING_CHARS) if position.castling >> index & 1)
+        en_passant = square_name(position.en_passant) if position.en_passant != EMPTY else '-'
+        return f"{'/'.join(ranks)} {'w' if position.turn == 1 else 'b'} {castling or '-'} {en_passant} " \
+               f"{position.halfmove} {position.fullmove}"
 
+    @staticmethod
+    def CreatePieces(position:'Position') -> 'list[Piece]':
+        pieces = []
+        for square, code in enumerate(position.squares):
+            if code == EMPTY:
+                continue
+            piece = ChessParser.create_piece(code // 6, PIECE_CHARS[code % 6], square)
+            if piece is not None:
+                pieces.append(piece)
         return pieces
     
     @staticmethod
-    def create_piece(color:int, piece_type:str, pos:list[int]) -> 'Optional[Piece]':
+    def create_piece(color:int, piece_type:str, square:int) -> 'Optional[Piece]':
         if piece_type == 'p':
-            return Pawn(color, pos)
+            return Pawn(color, square)
         elif piece_type == 'n':
-            return Knight(color, pos)
+            return Knight(color, square)
         elif piece_type == 'b':
-            return Bishop(color, pos)
+            return Bishop(color, square)
         elif piece_type == 'r':
-            return Rook(color, pos)
+            return Rook(color, square)
         elif piece_type == 'q':
-            return Queen(color, pos)   
+            return Queen(color, square)   
         elif piece_type =='k':
-            return King(color, pos)
+            return King(color, square)
         return None
 
 class MoveManager:
-    turn = 0
-
     @staticmethod
-    def LegalMoves(piece:'Optional[Piece]', board:'Board') -> list[list[int]]:
+    @profiled('board.legal_moves')
+    def LegalMoves(piece:'Optional[Piece]', board:'Board') -> list[int]:
         '''
-        Given a piece and the board state, we can calulate their legal moves of the piece.
+        Given a piece and the board state, we can calulate the legal moves of the piece, packed as in bitboard.encode_move.
         '''
         if piece is None:
             return []
 
-        if piece.color != MoveManager.turn:
+        if piece.color != board.position.turn:
             return []
     
-        legal_moves = piece.legal_moves(board)
-
-        legal_moves = [pos for pos in legal_moves if ((0 <= pos[0] <= 7) and (0 <= pos[1]<= 7))]
-        same_color_occupied_positions = [dummy_piece.position for dummy_piece in board.board if dummy_piece.color == piece.color]
-        legal_moves = list(filter(lambda x: x not in same_color_occupied_positions, legal_moves))
-        
-        if isinstance(piece, King) and piece.possible_castle:
-            legal_moves += piece.castling(board)
-
-        filtered_moves = []
-        
-        for move in legal_moves:
-            original_position = piece.position[:]
-            # Apply the move temporarily
-            piece.position = move
-            # Check if the player's king is still in check after the move
-            if not board.IsKingInCheck(piece.color):
-                filtered_moves.append(move)
-            # Revert the move
-            piece.position = original_position
-
-        return filtered_moves
+        start = piece.square
+        return [move for move in board.GenerateMoves() if move & 63 == start]
     
     @staticmethod
-    def AttackedSquares(piece:'Piece', board:'Board'):
-        attacking_squares = piece.attacking_squares(board)
-        attacking_squares = [pos for pos in attacking_squares if ((0 <= pos[0]<= 7) and (0 <= pos[1]<= 7))]
-        return attacking_squares
+    def AttackedSquares(piece:'Piece', board:'Board') -> list[int]:
+        return piece.attacking_squares(board)
     
     @staticmethod
-    def IsLegalMove(piece:'Piece', board:'Board', move:list[int]) -> bool:
+    def IsLegalMove(piece:'Piece', board:'Board', move:int) -> bool:
         legal_moves = MoveManager.LegalMoves(piece, board)
         return move in legal_moves
     
     @staticmethod
-    def capturePiece(selected_piece: 'Piece', board: 'Board', position: list[int]) -> None:
-        for piece in board.board:
-            if piece.color != selected_piece.color and piece.position == position:
-                board.board.remove(piece)
-                del piece
-                break
-        return
-
-    @staticmethod
-    def En_passant_takinator(selected_piece: 'Optional[Piece]', board: 'Board', position: list[int]) -> None:
-        if isinstance(selected_piece, Pawn):
-            for piece in board.board:
-                if isinstance(piece, Pawn) and piece.color != selected_piece.color and piece.en_passant_able and piece.position[1] == selected_piece.position[1]: 
-                    if abs(piece.position[0] - selected_piece.position[0]) == 1:
-                        board.board.remove(piece)
-                        del piece
-                    break
-        
-    @staticmethod
-    def castle_inator(selected_piece: 'King', board: 'Board', position: list[int]) -> None:
-        rank = position[1]
-        if isinstance(selected_piece, King):
-            castling_file = -1
-            rook = selected_piece
-
-            # king-sided castling
-            if rank == 6:
-                castling_file = 7
-                for possible_rook in board.board:
-                    if possible_rook.position[0] == castling_file  and possible_rook.position[1] == selected_piece.position[1] and \
-                    isinstance(possible_rook, Rook) and possible_rook.color == selected_piece.color:
-                        rook = possible_rook
-                        break
-                # move the rook
-                rook.position[0] -= 2
-                rook.rect.x = rook.position[0] * SQUARE_SIZE
-                
-            # Queen-sided castling
-            elif rank == 2:
-                castling_file = 0
-                for possible_rook in board.board:
-                    if possible_rook.position[0] == castling_file  and possible_rook.position[1] == selected_piece.position[1] and \
-                    isinstance(possible_rook, Rook) and possible_rook.color == selected_piece.color:
-                        rook = possible_rook
-                        break
-                # move the rook
-                rook.position[0] += 3
-                rook.rect.x = rook.position[0] * SQUARE_SIZE
-
-    @staticmethod
-    def MovePiece(selected_piece:'Optional[Piece]', board:'Board', legal_moves: list[list[int]]) -> 'Optional[bool]':
-        if selected_piece is None:
+    def MovePiece(selected_piece:'Optional[Piece]', board:'Board', legal_moves: list[int], target: Optional[int]) -> 'Optional[GameStatus]':
+        '''
+        Moves the selected piece to the target square if one of its legal moves goes there,
+        returns the state of the game after the move, or None if no move was played
+        '''
+        if selected_piece is None or target is None:
             return 
 
-        x_position, y_position = selected_piece.rect.x, selected_piece.rect.y
-        rank = round(x_position / SQUARE_SIZE)
-        file = round(y_position / SQUARE_SIZE)
-        position = [rank, file]
-
-        # Checks if the move is legal
-        if position not in legal_moves:
-            selected_piece.rect.x = selected_piece.position[0] * SQUARE_SIZE
-            selected_piece.rect.y = selected_piece.position[1] * SQUARE_SIZE
+        # Checks if the move is legal, promote pawn to queen (you can adjust this if you want other piece types)
+        for move in legal_moves:
+            if move_target(move) == target and move_promotion(move) in (0, QUEEN):
+                break
+        else:
             return
-        
-        selected_piece.rect.x = rank * SQUARE_SIZE
-        selected_piece.rect.y = file * SQUARE_SIZE
-
-        # Checks if we need to take a piece
-        MoveManager.capturePiece(selected_piece, board, position)
 
-        # Checks if we need to do en passant
-        MoveManager.En_passant_takinator(selected_piece, board, position)
+        # Perform the move, captures, en passant, castling and promotion included
+        board.make_move(move)
 
-        # move-rookinator (moves rook after castling)
-        MoveManager.castle_inator(selected_piece, board, position)
-    
-        # Checks if the pawn double moved to see if it en passantable 
-        if isinstance(selected_piece, Pawn) and abs(file - selected_piece.position[1]) == 2:
-            selected_piece.en_passant_able = True
-
-        # makes it so that en-passant is only possible right after
-        for piece in board.board:
-            if isinstance(piece, Pawn) and piece.color != selected_piece.color:
-                piece.en_passant_able = False
-
-        # Perform the move
-        selected_piece.position = position
-        MoveManager.turn ^= 1
-        
-        opponent_color = 1 - selected_piece.color
-
-        if isinstance(selected_piece, King):
-            selected_piece.possible_castle = False
-
-        elif isinstance(selected_piece, Rook):
-            selected_piece.castling = False
-
-            # Check for pawn promotion
-        if isinstance(selected_piece, Pawn):
-            if selected_piece.position[1] == 0 or selected_piece.position[1] == 7:
-                # Promote pawn to queen (you can adjust this if you want other piece types)
-                board.board.append(Queen(selected_piece.color, selected_piece.position))
-                board.board.remove(selected_piece)
-
-        # Check for checkmate
-        if board.IsCheckmate(opponent_color):
-            # End the game with a victory for the player who delivered the checkmate
-            return (selected_piece == 1)
+        # Checkmate, stalemate and the draw rules
+        return board.Status()
@@ -0,0 +1,166 @@
+'''
+Opening book in the Polyglot layout, read through mmap.
+
+A book is a file of 16 byte big-endian entries (key, move, weight, learn)
+sorted by key, so the moves of a position are found by binary search and
+every process reading the same book shares one page-cached copy of it.
+Moves are encoded the Polyglot way (castling as the king taking its rook),
+but the keys are this program's zobrist keys, as the Polyglot random
+numbers aren't reproduced here: books have to be built with this module.
+
+    python book.py build games.pgn -o book.bin --plies 20
+    python book.py probe "<fen>" book.bin
+'''
+import argparse
+import mmap
+import random
+import struct
+import sys
+from collections import Counter
+from typing import Iterable, Optional
+from bitboard import Position, MOVE_CASTLE, move_name
+from movegen import generate_moves
+from board import ChessParser
+from pgn import PgnGame, read_games, san_moves, parse_san
+from constants import STARTING_FEN
+
+ENTRY = struct.Struct('>QHHI')
+KEY = struct.Struct('>Q')
+MAX_WEIGHT = 0xFFFF
+
+
+def encode_book_move(move: int) -> int:
+    '''
+    Polyglot move bits: to file, to row, from file, from row, promotion, rows counted from white's side
+    '''
+    start = move & 63
+    target = move >> 6 & 63
+    if move >> 15 & 3 == MOVE_CASTLE:
+        target = target + 1 if target & 7 == 6 else target - 2
+    promotion = move >> 12 & 7
+    return ((target & 7) | (7 - (target >> 3)) << 3 | (start & 7) << 6 | (7 - (start >> 3)) << 9
+            | (5 - promotion if promotion else 0) << 12)
+
+
+class OpeningBook:
+    def __init__(self, path: str) -> None:
+        self.file = open(path, 'rb')
+        size = self.file.seek(0, 2)
+        # an empty file can't be mapped
+        self.map: Optional[mmap.mmap] = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.count = size // ENTRY.size
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self) -> 'OpeningBook':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def entries(self, key: int) -> 'list[tuple[int, int]]':
+        '''
+        (book move, weight) of every entry for key
+        '''
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.map, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        for index in range(low, self.count):
+            entry_key, book_move, weight, _ = ENTRY.unpack_from(self.map, index * ENTRY.size)
+            if entry_key != key:
+                break
+            found.append((book_move, weight))
+        return found
+
+    def moves(self, position: Position) -> 'list[tuple[int, int]]':
+        '''
+        (move, weight) of the book moves that are legal in position, heaviest first
+        '''
+        if not self.count:
+            return []
+        legal = {encode_book_move(move): move for move in generate_moves(position)}
+        found = [(legal[book_move], weight) for book_move, weight in self.entries(position.key) if book_move in legal]
+        return sorted(found, key=lambda entry: -entry[1])
+
+    def choose(self, position: Position, rng: Optional[random.Random] = None) -> Optional[int]:
+        '''
+        A book move picked at random by weight, or None when the position isn't in the book
+        '''
+        found = [(move, weight) for move, weight in self.moves(position) if weight]
+        if not found:
+            return None
+        rng = rng or random
+        return rng.choices([move for move, _ in found], [weight for _, weight in found])[0]
+
+
+def write_book(path: str, weights: 'Iterable[tuple[int, int, int]]') -> int:
+    '''
+    Writes (key, move, weight) entries as a sorted book, returns how many were written
+    '''
+    entries = sorted(((key, encode_book_move(move), min(weight, MAX_WEIGHT)) for key, move, weight in weights),
+                     key=lambda entry: (entry[0], -entry[2]))
+    with open(path, 'wb') as file:
+        for key, book_move, weight in entries:
+            file.write(ENTRY.pack(key, book_move, weight, 0))
+    return len(entries)
+
+def count_moves(games: 'Iterable[PgnGame]', plies: int) -> 'Counter[tuple[int, int]]':
+    '''
+    How often each (key, move) was played in the first plies of the games
+    '''
+    counts: 'Counter[tuple[int, int]]' = Counter()
+    for game in games:
+        try:
+            position = ChessParser.TranslateFen(game.tags.get('FEN', STARTING_FEN))
+        except ValueError:
+            continue
+        for ply, san in enumerate(san_moves(game.movetext)):
+            if ply >= plies:
+                break
+            try:
+                move = parse_san(position, san)
+            except ValueError:
+                break
+            counts[position.key, move] += 1
+            position.make_move(move)
+    return counts
+
+def main(argv: 'list[str] | None' = None) -> int:
+    parser = argparse.ArgumentParser(description='Build or look into an opening book.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='make a book from the opening moves of a PGN file')
+    build.add_argument('input', help='PGN file, - for stdin')
+    build.add_argument('-o', '--output', required=True)
+    build.add_argument('--plies', type=int, default=20, help='how deep into each game to go')
+    build.add_argument('--min-count', type=int, default=1, help='leave out moves played fewer times')
+    probe = commands.add_parser('probe', help='list the book moves of a position')
+    probe.add_argument('fen')
+    probe.add_argument('book')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        source = sys.stdin if args.input == '-' else open(args.input)
+        try:
+            counts = count_moves(read_games(source), args.plies)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        written = write_book(args.output, ((key, move, count) for (key, move), count in counts.items()
+                                           if count >= args.min_count))
+        print(f'{written} entries written', file=sys.stderr)
+    else:
+        with OpeningBook(args.book) as book:
+            for move, weight in book.moves(ChessParser.TranslateFen(args.fen)):
+                print(move_name(move), weight)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
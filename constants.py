@@ -3,4 +3,5 @@ BLACK = (228, 193, 112) #rgb(228,193,112)
 SELECTED_WHITE = (255, 220, 224)
 SELECTED_BLACK = (250, 150, 150)
 WIDTH, HEIGHT = 512, 512
-SQUARE_SIZE = min(WIDTH, HEIGHT)//8
\ No newline at end of file
+SQUARE_SIZE = min(WIDTH, HEIGHT)//8
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
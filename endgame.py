@@ -0,0 +1,320 @@
+'''
+Endgame tables for positions with a handful of pieces, read through mmap.
+
+A table covers one material balance, say KQvK, and holds one byte for every
+way of placing its pieces with either side to move: 0 for a draw (or a
+placement that can't happen), n for a win with mate in n plies, -(n + 1)
+for a loss being mated in n plies. The byte of a position is found by
+arithmetic on its piece squares, so a probe is a single read from a file
+that every process shares through the page cache. Tables for the same
+material with the colors swapped are read mirrored.
+
+Tables are made here by working backwards from the mates, with NumPy. A
+table whose captures or promotions lead to other material needs those
+tables made first, apart from material nobody can win with. The moves of
+every placement are worked out in Python and kept as 4 byte indices, so
+three pieces take a minute or so and about 100 MB, and four pieces (64
+times the placements) take hours and several GB, which is as far as this
+generator is meant to go.
+
+    python endgame.py generate KQvK KRvK KPvK -d tables/
+    python endgame.py probe "8/8/8/4k3/8/8/8/4K2Q w - - 0 1" -d tables/
+'''
+import argparse
+import mmap
+from array import array
+import os
+import struct
+import sys
+from typing import NamedTuple, Optional
+from bitboard import Position, KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN, EMPTY, PIECE_CHARS, iter_bits, move_name
+from movegen import generate_moves, checkers
+from gamestate import insufficient_material
+from board import ChessParser
+
+MAGIC = b'CTB1'
+# magic, piece count, material signature padded with spaces
+HEADER = struct.Struct('>4sB11s')
+SUFFIX = '.ctb'
+MAX_PLIES = 127
+# scores while generating, from the side to move's point of view
+WIN_SCORE = 1000
+UNKNOWN = 1 << 20
+PIECE_ORDER = (KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN)
+BACK_RANKS = 0xFF | 0xFF << 56
+
+
+class TableResult(NamedTuple):
+    wdl: int        # 1 win, 0 draw, -1 loss, for the side to move
+    plies: int      # to mate, 0 for a draw
+
+    @property
+    def score(self) -> int:
+        return self.wdl * (WIN_SCORE - self.plies) if self.wdl else 0
+
+
+def material_signature(position: Position) -> str:
+    '''
+    White's pieces, v, black's pieces, kings first: KRPvKR
+    '''
+    sides = []
+    for color in (1, 0):
+        sides.append(''.join(PIECE_CHARS[piece_type].upper() * position.pieces_of(color, piece_type).bit_count()
+                             for piece_type in PIECE_ORDER))
+    return 'v'.join(sides)
+
+def signature_slots(signature: str) -> 'list[tuple[int, int]]':
+    '''
+    (color, piece type) of every piece of the signature, in index order
+    '''
+    white, black = signature.upper().split('V')
+    return [(color, PIECE_CHARS.index(character.lower())) for color, side in ((1, white), (0, black)) for character in side]
+
+def mirror_signature(signature: str) -> str:
+    white, black = signature.upper().split('V')
+    return f'{black}v{white}'
+
+def table_index(position: Position, slots: 'list[tuple[int, int]]', mirrored: bool = False) -> int:
+    '''
+    Where position is in a table with the given slots, mirrored reads it with the colors swapped
+    '''
+    index = 0
+    shift = 0
+    previous = None
+    squares = []
+    for color, piece_type in slots:
+        if (color, piece_type) != previous:
+            # pieces of the same kind fill their slots in square order
+            squares = list(iter_bits(position.pieces_of(1 - color if mirrored else color, piece_type)))
+            previous = (color, piece_type)
+        square = squares.pop(0)
+        index |= (square ^ 56 if mirrored else square) << shift
+        shift += 6
+    turn = 1 - position.turn if mirrored else position.turn
+    return turn << shift | index
+
+def _decode(value: int) -> TableResult:
+    if value > 0:
+        return TableResult(1, value)
+    if value < 0:
+        return TableResult(-1, -value - 1)
+    return TableResult(0, 0)
+
+
+class EndgameTables:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        # signature -> (file, map, slots), None for a signature without a table
+        self.tables: 'dict[str, Optional[tuple]]' = {}
+
+    def close(self) -> None:
+        for table in self.tables.values():
+            if table is not None:
+                table[1].close()
+                table[0].close()
+        self.tables.clear()
+
+    def __enter__(self) -> 'EndgameTables':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _table(self, signature: str) -> Optional[tuple]:
+        if signature not in self.tables:
+            path = os.path.join(self.directory, signature + SUFFIX)
+            table = None
+            if os.path.exists(path):
+                file = open(path, 'rb')
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, _, stored = HEADER.unpack_from(data)
+                if magic != MAGIC or stored.decode().strip() != signature:
+                    data.close()
+                    file.close()
+                    raise ValueError(f'{path} is not a table for {signature}')
+                table = (file, data, signature_slots(signature))
+            self.tables[signature] = table
+        return self.tables[signature]
+
+    def probe(self, position: Position) -> Optional[TableResult]:
+        '''
+        The table result of position, None when there's no table for it
+        '''
+        if position.castling or position.en_passant != EMPTY:
+            return None
+        signature = material_signature(position)
+        mirrored = False
+        table = self._table(signature)
+        if table is None:
+            table = self._table(mirror_signature(signature))
+            mirrored = True
+            if table is None:
+                return None
+        _, data, slots = table
+        value = struct.unpack_from('b', data, HEADER.size + table_index(position, slots, mirrored))[0]
+        return _decode(value)
+
+    def best_move(self, position: Position) -> Optional[int]:
+        '''
+        The move keeping the best table result, quickest mate or slowest loss,
+        None when some move leads outside the tables
+        '''
+        best, best_score = None, None
+        for move in generate_moves(position):
+            position.make_move(move)
+            result = self.probe(position)
+            if result is None and insufficient_material(position):
+                result = TableResult(0, 0)
+            if result is None and not generate_moves(position):
+                result = TableResult(-1, 0) if checkers(position) else TableResult(0, 0)
+            position.unmake_move()
+            if result is None:
+                return None
+            score = -result.score
+            if best_score is None or score > best_score:
+                best, best_score = move, score
+        return best
+
+
+def _placement(index: int, slots: 'list[tuple[int, int]]') -> Optional[Position]:
+    '''
+    The position at index of a table, None if the pieces overlap or it can't come up in a game
+    '''
+    position = Position()
+    for color, piece_type in slots:
+        square = index & 63
+        index >>= 6
+        if not position.is_empty(square):
+            return None
+        if piece_type == PAWN and (1 << square) & BACK_RANKS:
+            return None
+        position.put_piece(square, color * 6 + piece_type)
+    position.turn = index
+    # the side that just moved can't have left its king in check
+    king = position.king_square(1 - position.turn)
+    if king is None or position.is_square_attacked(king, position.turn):
+        return None
+    return position
+
+def generate(signature: str, directory: str, verbose: bool = False) -> str:
+    '''
+    Works out the table of signature and writes it to directory, returns its path
+    '''
+    import numpy as np
+
+    slots = signature_slots(signature)
+    signature = material_signature(_placement_for(slots))
+    size = 2 << 6 * len(slots)
+    tables = EndgameTables(directory)
+
+    # children of every placement one after the other, as 4 byte indices into the scores,
+    # past size for the positions other tables (or the rules) already decide
+    counts = np.zeros(size, dtype=np.int32)
+    children = array('I')
+    external = array('i')
+    values = np.full(size, UNKNOWN, dtype=np.int32)
+    valid = np.zeros(size, dtype=bool)
+    for index in range(size):
+        position = _placement(index, slots)
+        if position is None:
+            continue
+        valid[index] = True
+        moves = generate_moves(position)
+        if not moves:
+            values[index] = -WIN_SCORE if checkers(position) else 0
+            continue
+        for move in moves:
+            position.make_move(move)
+            if material_signature(position) == signature:
+                children.append(table_index(position, slots))
+            else:
+                if insufficient_material(position):
+                    score = 0
+                else:
+                    result = tables.probe(position)
+                    if result is None:
+                        raise ValueError(f'{material_signature(position)} has to be generated before {signature}')
+                    score = result.score
+                children.append(size + len(external))
+                external.append(score)
+            position.unmake_move()
+        counts[index] = len(moves)
+    tables.close()
+
+    scores = np.concatenate([values, np.frombuffer(external, dtype=np.int32)])
+    del values
+    children_array = np.frombuffer(children, dtype=np.uint32)
+    parents = np.flatnonzero(counts)
+    starts = np.concatenate([[0], np.cumsum(counts[parents])[:-1]]).astype(np.int64)
+    longest_external = max((WIN_SCORE - abs(score) for score in external if score), default=0)
+
+    plies = 1
+    quiet = 0
+    while quiet < 2 or plies <= longest_external + 1:
+        child_scores = scores[children_array]
+        open_parents = scores[parents] == UNKNOWN
+        # a win if some move mates or leads to a loss one ply shorter
+        wins = np.logical_or.reduceat(child_scores == -(WIN_SCORE - (plies - 1)), starts) & open_parents
+        # a loss if every move leads to a win, the longest of them one ply shorter
+        winning = (child_scores != UNKNOWN) & (child_scores > 0)
+        all_winning = np.logical_and.reduceat(winning, starts)
+        slowest = np.minimum.reduceat(np.where(winning, child_scores, UNKNOWN), starts)
+        losses = all_winning & (slowest == WIN_SCORE - (plies - 1)) & open_parents
+        scores[parents[wins]] = WIN_SCORE - plies
+        scores[parents[losses]] = -(WIN_SCORE - plies)
+        quiet = 0 if wins.any() or losses.any() else quiet + 1
+        if verbose:
+            print(f'{signature} ply {plies}: {int(wins.sum())} wins, {int(losses.sum())} losses', file=sys.stderr)
+        plies += 1
+
+    scores = scores[:size]
+    decided = valid & (scores != UNKNOWN) & (scores != 0)
+    plies_to_mate = WIN_SCORE - np.abs(scores)
+    if decided.any() and plies_to_mate[decided].max() > MAX_PLIES:
+        raise ValueError(f'a mate in {int(plies_to_mate[decided].max())} plies does not fit in a table entry')
+    table = np.where(decided, np.where(scores > 0, plies_to_mate, -plies_to_mate - 1), 0).astype(np.int8)
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, signature + SUFFIX)
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(slots), signature.ljust(11).encode()))
+        file.write(table.tobytes())
+    return path
+
+def _placement_for(slots: 'list[tuple[int, int]]') -> Position:
+    # any position with the material of slots, to write its signature the usual way
+    position = Position()
+    for square, (color, piece_type) in enumerate(slots):
+        position.put_piece(square + 8, color * 6 + piece_type)
+    return position
+
+def main(argv: 'list[str] | None' = None) -> int:
+    parser = argparse.ArgumentParser(description='Make or probe endgame tables.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    make = commands.add_parser('generate', help='work out tables, in the order given')
+    make.add_argument('signatures', nargs='+', help='material such as KQvK')
+    make.add_argument('-d', '--directory', default='tables')
+    make.add_argument('-v', '--verbose', action='store_true')
+    probe = commands.add_parser('probe', help='look a position up')
+    probe.add_argument('fen')
+    probe.add_argument('-d', '--directory', default='tables')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        for signature in args.signatures:
+            print(generate(signature, args.directory, args.verbose))
+    else:
+        position = ChessParser.TranslateFen(args.fen)
+        with EndgameTables(args.directory) as tables:
+            result = tables.probe(position)
+            if result is None:
+                print('no table')
+            else:
+                print(('loss', 'draw', 'win')[result.wdl + 1], f'mate in {result.plies} plies' if result.wdl else '')
+                move = tables.best_move(position)
+                if move is not None:
+                    print(f'bestmove {move_name(move)}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
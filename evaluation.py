@@ -0,0 +1,215 @@
+'''
+Static evaluation: material, piece-square tables, mobility, pawn structure
+and king safety, blended between middlegame and endgame by the material left.
+
+Material and piece-square sums are kept on the Position by every piece it
+puts down or picks up (see pst.py), so making and taking back moves keeps
+them current and evaluate only adds the terms that depend on the whole
+board. evaluate_batch scores a vectorized.PositionBatch with NumPy and gives
+exactly the same numbers as evaluate.
+'''
+from bitboard import Position, KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN, iter_bits
+from attacks import KNIGHT_ATTACKS, KING_ATTACKS, rook_attacks, bishop_attacks, queen_attacks
+from pst import PST_MG, PST_EG
+
+FULL = (1 << 64) - 1
+FILE_A = 0x0101010101010101
+NOT_FILE_A = FULL & ~FILE_A
+NOT_FILE_H = FULL & ~(FILE_A << 7)
+FILES = tuple(FILE_A << file for file in range(8))
+ADJACENT_FILES = tuple((FILES[file - 1] if file > 0 else 0) | (FILES[file + 1] if file < 7 else 0) for file in range(8))
+
+# how much each piece counts towards the middlegame, 24 with all pieces on the board
+PHASE_WEIGHTS = (0, 4, 2, 1, 1, 0)
+TOTAL_PHASE = 24
+# per safe square a piece attacks, in 'kqrbnp' order
+MOBILITY_MG = (0, 1, 2, 5, 4, 0)
+MOBILITY_EG = (0, 2, 4, 5, 4, 0)
+DOUBLED_PAWN = (-10, -20)
+ISOLATED_PAWN = (-10, -15)
+# by how many ranks the pawn has advanced
+PASSED_PAWN_MG = (0, 5, 10, 15, 25, 40, 60, 0)
+PASSED_PAWN_EG = (0, 10, 20, 35, 60, 90, 130, 0)
+# per own pawn in front of the king, and per attack on the squares around the enemy king
+PAWN_SHIELD = 10
+KING_ZONE_ATTACK = 4
+TEMPO = 10
+
+
+def _passed_mask(color: int, square: int) -> int:
+    file, rank = square & 7, square >> 3
+    ahead = range(rank) if color == 1 else range(rank + 1, 8)
+    mask = 0
+    for y in ahead:
+        for x in (file - 1, file, file + 1):
+            if 0 <= x <= 7:
+                mask |= 1 << (y * 8 + x)
+    return mask
+
+def _shield_mask(color: int, square: int) -> int:
+    file, rank = square & 7, square >> 3
+    step = -1 if color == 1 else 1
+    mask = 0
+    for y in (rank + step, rank + 2 * step):
+        for x in (file - 1, file, file + 1):
+            if 0 <= x <= 7 and 0 <= y <= 7:
+                mask |= 1 << (y * 8 + x)
+    return mask
+
+# the squares in front of a pawn that no enemy pawn may stand on for it to be passed, by color and square
+PASSED_MASKS = tuple(tuple(_passed_mask(color, square) for square in range(64)) for color in range(2))
+SHIELD_MASKS = tuple(tuple(_shield_mask(color, square) for square in range(64)) for color in range(2))
+KING_ZONES = tuple(KING_ATTACKS[square] | 1 << square for square in range(64))
+# by color and square, ranks advanced from the pawn's starting side
+ADVANCEMENT = tuple(tuple(7 - (square >> 3) if color == 1 else square >> 3 for square in range(64)) for color in range(2))
+
+
+def pawn_attacks(pawns: int, color: int) -> int:
+    if color == 1:
+        return (pawns >> 9) & NOT_FILE_H | (pawns >> 7) & NOT_FILE_A
+    return (pawns << 7) & NOT_FILE_H | (pawns << 9) & NOT_FILE_A
+
+def game_phase(position: Position) -> int:
+    '''
+    From TOTAL_PHASE with every piece on the board down to 0 with only kings and pawns
+    '''
+    pieces = position.pieces
+    phase = sum(PHASE_WEIGHTS[piece_type] * pieces[piece_type].bit_count() for piece_type in (QUEEN, ROOK, BISHOP, KNIGHT))
+    return min(phase, TOTAL_PHASE)
+
+def evaluate(position: Position) -> int:
+    '''
+    Score in centipawns from the side to move's point of view
+    '''
+    pieces = position.pieces
+    colors = position.colors
+    occupied = colors[0] | colors[1]
+    pawns = (colors[0] & pieces[PAWN], colors[1] & pieces[PAWN])
+    kings = (colors[0] & pieces[KING], colors[1] & pieces[KING])
+    mg, eg = position.mg, position.eg
+
+    for color in (0, 1):
+        sign = 1 if color == 1 else -1
+        own = colors[color]
+        safe = FULL & ~own & ~pawn_attacks(pawns[1 - color], 1 - color)
+        enemy_king = kings[1 - color]
+        zone = KING_ZONES[enemy_king.bit_length() - 1] if enemy_king else 0
+
+        mobility_mg = mobility_eg = zone_attacks = 0
+        for piece_type in (QUEEN, ROOK, BISHOP, KNIGHT):
+            for square in iter_bits(own & pieces[piece_type]):
+                if piece_type == KNIGHT:
+                    attacked = KNIGHT_ATTACKS[square]
+                elif piece_type == BISHOP:
+                    attacked = bishop_attacks(square, occupied)
+                elif piece_type == ROOK:
+                    attacked = rook_attacks(square, occupied)
+                else:
+                    attacked = queen_attacks(square, occupied)
+                count = (attacked & safe).bit_count()
+                mobility_mg += MOBILITY_MG[piece_type] * count
+                mobility_eg += MOBILITY_EG[piece_type] * count
+                zone_attacks += (attacked & zone).bit_count()
+        mg += sign * (mobility_mg + KING_ZONE_ATTACK * zone_attacks)
+        eg += sign * mobility_eg
+
+        own_pawns = pawns[color]
+        enemy_pawns = pawns[1 - color]
+        for file in range(8):
+            on_file = (own_pawns & FILES[file]).bit_count()
+            if on_file > 1:
+                mg += sign * DOUBLED_PAWN[0] * (on_file - 1)
+                eg += sign * DOUBLED_PAWN[1] * (on_file - 1)
+            if on_file and not own_pawns & ADJACENT_FILES[file]:
+                mg += sign * ISOLATED_PAWN[0] * on_file
+                eg += sign * ISOLATED_PAWN[1] * on_file
+        for square in iter_bits(own_pawns):
+            if not enemy_pawns & PASSED_MASKS[color][square]:
+                advanced = ADVANCEMENT[color][square]
+                mg += sign * PASSED_PAWN_MG[advanced]
+                eg += sign * PASSED_PAWN_EG[advanced]
+
+        if kings[color]:
+            shield = own_pawns & SHIELD_MASKS[color][kings[color].bit_length() - 1]
+            mg += sign * PAWN_SHIELD * shield.bit_count()
+
+    phase = game_phase(position)
+    score = (mg * phase + eg * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+    return (score if position.turn == 1 else -score) + TEMPO
+
+
+def evaluate_batch(batch) -> 'numpy.ndarray':
+    '''
+    int64 [N] scores of a vectorized.PositionBatch, the same as evaluate gives for each position
+    '''
+    import numpy as np
+    from vectorized import (U64, ROOK_DIRECTIONS, BISHOP_DIRECTIONS, KNIGHT_STEPS, PAWN_CAPTURES,
+                            popcount, step, ray_fill)
+
+    pieces = batch.pieces
+    count = len(batch.turn)
+    flat = pieces.reshape(count, 12)
+    # bit s of every bitboard, [N, 12, 64], little endian so byte order matches square order
+    bits = np.unpackbits(flat.astype('<u8').view(np.uint8), axis=1, bitorder='little').reshape(count, 12, 64)
+    mg = np.einsum('nks,ks->n', bits, np.array(PST_MG, dtype=np.int64))
+    eg = np.einsum('nks,ks->n', bits, np.array(PST_EG, dtype=np.int64))
+
+    occupied = np.bitwise_or.reduce(flat, axis=1)
+    zero = np.zeros(count, dtype=U64)
+    king_zones = np.array(KING_ZONES, dtype=U64)
+    king_squares = [bits[:, color * 6 + KING].argmax(axis=1) for color in range(2)]
+    has_king = [pieces[:, color, KING] != 0 for color in range(2)]
+    files = [U64(mask) for mask in FILES]
+    adjacent = [U64(mask) for mask in ADJACENT_FILES]
+    directions = {QUEEN: ROOK_DIRECTIONS + BISHOP_DIRECTIONS, ROOK: ROOK_DIRECTIONS, BISHOP: BISHOP_DIRECTIONS}
+
+    for color in (0, 1):
+        sign = 1 if color == 1 else -1
+        own = np.bitwise_or.reduce(pieces[:, color], axis=1)
+        enemy_pawn_attacks = zero.copy()
+        for amount, mask in PAWN_CAPTURES[1 - color]:
+            enemy_pawn_attacks |= step(pieces[:, 1 - color, PAWN], amount, mask)
+        safe = ~own & ~enemy_pawn_attacks
+        zone = np.where(has_king[1 - color], king_zones[king_squares[1 - color]], zero)
+
+        # every ray belongs to one piece, so counting a whole set's rays per direction sums the pieces' counts
+        zone_attacks = np.zeros(count, dtype=np.int64)
+        for piece_type in (QUEEN, ROOK, BISHOP, KNIGHT):
+            group = pieces[:, color, piece_type]
+            if piece_type == KNIGHT:
+                reached = [step(group, amount, mask) for amount, mask in KNIGHT_STEPS]
+            else:
+                reached = [ray_fill(group, occupied, amount, mask) for amount, mask in directions[piece_type]]
+            for attacked in reached:
+                safe_count = popcount(attacked & safe)
+                mg += sign * MOBILITY_MG[piece_type] * safe_count
+                eg += sign * MOBILITY_EG[piece_type] * safe_count
+                zone_attacks += popcount(attacked & zone)
+        mg += sign * KING_ZONE_ATTACK * zone_attacks
+
+        own_pawns = pieces[:, color, PAWN]
+        enemy_pawns = pieces[:, 1 - color, PAWN]
+        for file in range(8):
+            on_file = popcount(own_pawns & files[file])
+            doubled = np.maximum(on_file - 1, 0)
+            mg += sign * DOUBLED_PAWN[0] * doubled
+            eg += sign * DOUBLED_PAWN[1] * doubled
+            isolated = np.where((own_pawns & adjacent[file]) == 0, on_file, 0)
+            mg += sign * ISOLATED_PAWN[0] * isolated
+            eg += sign * ISOLATED_PAWN[1] * isolated
+
+        passed_masks = np.array(PASSED_MASKS[color], dtype=U64)
+        passed = bits[:, color * 6 + PAWN].astype(bool) & ((enemy_pawns[:, None] & passed_masks[None, :]) == 0)
+        advancement = np.array(ADVANCEMENT[color])
+        mg += sign * passed @ np.array(PASSED_PAWN_MG)[advancement]
+        eg += sign * passed @ np.array(PASSED_PAWN_EG)[advancement]
+
+        shield_masks = np.array(SHIELD_MASKS[color], dtype=U64)
+        shield = np.where(has_king[color], own_pawns & shield_masks[king_squares[color]], zero)
+        mg += sign * PAWN_SHIELD * popcount(shield)
+
+    phase = sum(PHASE_WEIGHTS[piece_type] * popcount(pieces[:, 0, piece_type] | pieces[:, 1, piece_type])
+                for piece_type in (QUEEN, ROOK, BISHOP, KNIGHT))
+    phase = np.minimum(phase, TOTAL_PHASE)
+    score = (mg * phase + eg * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+    return np.where(batch.turn == 1, score, -score) + TEMPO
@@ -0,0 +1,80 @@
+'''
+How a game stands: still going, won, or drawn, and why.
+
+Checkmate and stalemate come from the legal moves, the fifty-move rule from
+the halfmove clock, threefold repetition from a count of how often each
+zobrist key came up in the game, and insufficient material from the pieces
+left. Board keeps the counts up to date move by move, so every check here
+is a lookup.
+'''
+from collections import Counter
+from typing import NamedTuple, Optional
+from bitboard import Position, QUEEN, ROOK, BISHOP, KNIGHT, PAWN
+from movegen import generate_moves, checkers
+
+ONGOING = '*'
+WHITE_WINS = '1-0'
+BLACK_WINS = '0-1'
+DRAW = '1/2-1/2'
+
+# halfmoves without a capture or pawn move before the game is drawn
+FIFTY_MOVE_PLIES = 100
+# the light squares, a8 being light
+LIGHT_SQUARES = sum(1 << square for square in range(64) if (square + (square >> 3)) % 2 == 0)
+
+
+class GameStatus(NamedTuple):
+    result: str
+    reason: Optional[str] = None
+
+    @property
+    def is_over(self) -> bool:
+        return self.result != ONGOING
+
+
+def insufficient_material(position: Position) -> bool:
+    '''
+    Neither side can ever mate: bare kings, a single minor piece, or only
+    bishops that all stand on the same color
+    '''
+    pieces = position.pieces
+    if pieces[PAWN] | pieces[ROOK] | pieces[QUEEN]:
+        return False
+    minors = pieces[KNIGHT] | pieces[BISHOP]
+    if minors.bit_count() <= 1:
+        return True
+    if pieces[KNIGHT]:
+        return False
+    bishops = pieces[BISHOP]
+    return not bishops & LIGHT_SQUARES or not bishops & ~LIGHT_SQUARES
+
+def position_counts(position: Position) -> 'Counter[int]':
+    '''
+    How often each key came up in the moves played on position, for a
+    position whose history wasn't followed move by move
+    '''
+    counts = Counter(entry[5] for entry in position.history)
+    counts[position.key] += 1
+    return counts
+
+def game_status(position: Position, counts: 'Counter[int]', moves: Optional[list[int]] = None,
+                in_check: Optional[bool] = None) -> GameStatus:
+    '''
+    counts is how often every key came up so far, the current position included,
+    moves and in_check are worked out here when they aren't given
+    '''
+    if moves is None:
+        moves = generate_moves(position)
+    if not moves:
+        if in_check is None:
+            in_check = bool(checkers(position))
+        if in_check:
+            return GameStatus(WHITE_WINS if position.turn == 0 else BLACK_WINS, 'checkmate')
+        return GameStatus(DRAW, 'stalemate')
+    if position.halfmove >= FIFTY_MOVE_PLIES:
+        return GameStatus(DRAW, 'fifty-move rule')
+    if counts[position.key] >= 3:
+        return GameStatus(DRAW, 'threefold repetition')
+    if insufficient_material(position):
+        return GameStatus(DRAW, 'insufficient material')
+    return GameStatus(ONGOING)
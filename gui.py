@@ -0,0 +1,188 @@
+import pygame
+from typing import Optional
+from constants import WHITE, BLACK, SQUARE_SIZE, SELECTED_WHITE, SELECTED_BLACK
+from board import Board
+from bitboard import EMPTY, move_target
+from pieces import Piece
+from sprites import SpriteAtlas
+from profiling import profiled, summary_lines
+
+class BoardView:
+    '''
+    Draws a Board in a pygame window and keeps track of the piece being dragged,
+    the rules code never needs anything from here.
+
+    Only squares that changed since the last frame are drawn again: what is
+    on screen is remembered per square (piece and highlight), and the squares
+    under the dragged piece are redrawn as it moves.
+    '''
+    def __init__(self, win:pygame.Surface, atlas:SpriteAtlas, board:Board, square_size:int = SQUARE_SIZE) -> None:
+        self.WIN = win
+        self.atlas = atlas
+        self.board = board
+        self.selected_piece:'Optional[Piece]' = None
+        self.drag_rect:'Optional[pygame.Rect]' = None
+        self.drawn_drag_rect:'Optional[pygame.Rect]' = None
+        # profiling stats drawn over the top left of the board, toggled with ToggleOverlay
+        self.show_overlay = False
+        self.drawn_overlay_rect:'Optional[pygame.Rect]' = None
+        self.Resize(square_size)
+
+    def Resize(self, square_size:int, win:'Optional[pygame.Surface]' = None) -> None:
+        '''
+        Lays the board out for another square size, the sprites for it are made on the next draw
+        '''
+        if win is not None:
+            self.WIN = win
+        self.square_size = square_size
+        self.atlas.Resize(square_size)
+        self.graphical_board:'list[pygame.Rect]' = [
+            pygame.Rect(i * square_size, j * square_size, square_size, square_size)
+            for i in range(8) for j in range(8)
+            ]
+        self.background = self.RenderBackground()
+        if self.selected_piece is not None:
+            x, y = self.selected_piece.square & 7, self.selected_piece.square >> 3
+            self.drag_rect = pygame.Rect(x * square_size, y * square_size, square_size, square_size)
+        self.drawn_drag_rect = None
+        self.drawn_overlay_rect = None
+        # (piece code, highlighted) on screen for every square, None when it has to be drawn again
+        self.drawn:'list[Optional[tuple[int, bool]]]' = [None] * 64
+
+    def RenderBackground(self) -> pygame.Surface:
+        background = pygame.Surface((8 * self.square_size, 8 * self.square_size))
+        for rank in range(8):
+            for file in range(8):
+                square_color = WHITE if (rank + file) % 2 == 0 else BLACK
+                pygame.draw.rect(background, square_color, self.graphical_board[rank + 8 * file])
+        return background
+
+    def Invalidate(self) -> None:
+        '''
+        Makes the next DrawDirty redraw everything, for when the window lost its contents
+        '''
+        self.drawn = [None] * 64
+
+    def SquareRect(self, square:int) -> pygame.Rect:
+        return self.graphical_board[(square & 7) * 8 + (square >> 3)]
+
+    def ToggleOverlay(self) -> None:
+        self.show_overlay = not self.show_overlay
+
+    @profiled('draw.frame')
+    def DrawDirty(self, legal_moves:list[int]) -> list[pygame.Rect]:
+        '''
+        Draws the squares that changed since the last call and returns the
+        parts of the window that have to be updated
+        '''
+        highlighted = {move_target(move) for move in legal_moves}
+        squares = self.board.position.squares
+        # the dragged piece is drawn at the mouse, not on its square
+        hidden = self.selected_piece.square if self.selected_piece is not None else -1
+
+        dirty = []
+        for square in range(64):
+            state = (EMPTY if square == hidden else squares[square], square in highlighted)
+            if state != self.drawn[square]:
+                dirty.append(square)
+                self.drawn[square] = state
+
+        # the overlay changes every frame, so the squares under it are always drawn again
+        overlay = self.RenderOverlay() if self.show_overlay else None
+        overlay_rect = overlay.get_rect() if overlay is not None else None
+        covered = (self.SquaresUnder(self.drawn_drag_rect) | self.SquaresUnder(self.drag_rect)
+                   | self.SquaresUnder(self.drawn_overlay_rect) | self.SquaresUnder(overlay_rect))
+        dirty += [square for square in covered if square not in dirty]
+        if not dirty:
+            return []
+
+        self.DrawBoard(dirty)
+        self.DrawSelectedSquares([square for square in dirty if square in highlighted])
+        self.DrawPieces([square for square in dirty if square != hidden])
+        if overlay is not None:
+            self.WIN.blit(overlay, overlay_rect)
+
+        updated = [self.SquareRect(square) for square in dirty]
+        self.drawn_drag_rect = self.drag_rect.copy() if self.drag_rect is not None else None
+        self.drawn_overlay_rect = overlay_rect
+        return updated
+
+    def RenderOverlay(self) -> pygame.Surface:
+        lines = summary_lines() or ['profiling is off, start with CHESS_PROFILE=1']
+        font = pygame.font.Font(None, 16)
+        rendered = [font.render(line, True, (255, 255, 255)) for line in lines]
+        width = min(max(text.get_width() for text in rendered) + 8, 8 * self.square_size)
+        height = min(sum(text.get_height() for text in rendered) + 8, 8 * self.square_size)
+        overlay = pygame.Surface((width, height), pygame.SRCALPHA)
+        overlay.fill((0, 0, 0, 170))
+        y = 4
+        for text in rendered:
+            overlay.blit(text, (4, y))
+            y += text.get_height()
+        return overlay
+
+    def SquaresUnder(self, rect:'Optional[pygame.Rect]') -> set[int]:
+        if rect is None:
+            return set()
+        size = self.square_size
+        first_x, last_x = max(rect.left // size, 0), min((rect.right - 1) // size, 7)
+        first_y, last_y = max(rect.top // size, 0), min((rect.bottom - 1) // size, 7)
+        return {y * 8 + x for x in range(first_x, last_x + 1) for y in range(first_y, last_y + 1)}
+
+    @profiled('draw.board')
+    def DrawBoard(self, squares:list[int]) -> None:
+        for square in squares:
+            rect = self.SquareRect(square)
+            self.WIN.blit(self.background, rect, rect)
+
+    @profiled('draw.pieces')
+    def DrawPieces(self, squares:list[int]) -> None:
+        '''
+        Let's you draw the pieces on the given squares, the dragged one follows the mouse
+        '''
+        position = self.board.position
+        for square in squares:
+            code = position.squares[square]
+            if code != EMPTY:
+                self.atlas.Blit(self.WIN, code // 6, code % 6, self.SquareRect(square))
+        # drawn last so it stays on top of the piece it's dragged over
+        if self.selected_piece is not None:
+            self.atlas.Blit(self.WIN, self.selected_piece.color, self.selected_piece.piece_type, self.drag_rect)
+
+    @profiled('draw.highlights')
+    def DrawSelectedSquares(self, squares:list[int]) -> None:
+        for square in squares:
+            file, rank = square & 7, square >> 3
+            square_color = SELECTED_WHITE if ((file + rank) % 2 == 0 ) else SELECTED_BLACK
+            pygame.draw.rect(self.WIN, square_color, self.SquareRect(square))
+
+    def PickPiece(self, pos:'tuple[int, int]') -> 'Optional[Piece]':
+        '''
+        Starts dragging the piece under the mouse, if there is one
+        '''
+        size = self.square_size
+        x, y = pos[0] // size, pos[1] // size
+        if not (0 <= x <= 7 and 0 <= y <= 7):
+            return None
+        piece = self.board.PieceAt(y * 8 + x)
+        if piece is not None:
+            self.selected_piece = piece
+            self.drag_rect = pygame.Rect(x * size, y * size, size, size)
+        return piece
+
+    def DragPiece(self, rel:'tuple[int, int]') -> None:
+        if self.drag_rect is not None:
+            self.drag_rect.move_ip(rel)
+
+    def DropPiece(self) -> 'Optional[int]':
+        '''
+        Stops dragging and returns the square the piece was dropped on, None when it's off the board
+        '''
+        if self.drag_rect is None:
+            return None
+        x, y = round(self.drag_rect.x / self.square_size), round(self.drag_rect.y / self.square_size)
+        self.selected_piece = None
+        self.drag_rect = None
+        if not (0 <= x <= 7 and 0 <= y <= 7):
+            return None
+        return y * 8 + x
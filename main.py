@@ -1,84 +1,95 @@
-import pygame
-from pieces import Piece
-from board import Board, MoveManager
-from constants import (WHITE,
-                       BLACK,
-                       SELECTED_BLACK,
-                       SELECTED_WHITE,
-                       WIDTH,
-                       HEIGHT,
-                       SQUARE_SIZE)
-from typing import Optional
-
-pygame.font.init()
-
-WIN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption('chess maybe 2')
-
-def load_image_piece(path:str) -> pygame.Surface:
-    image = pygame.image.load(path)
-    image = pygame.transform.scale(image, (SQUARE_SIZE, SQUARE_SIZE))
-    return image
-
-STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
-IMAGES = [[load_image_piece(f'./pieces_svgs/piece_{i}{j}.svg') for j in range(6)] for i in range(2)]
-
-# To Do:
-# [x] Board
-# [x] pieces
-# [x] basic legal moves
-# [x] highlighting of legal moves
-# [x] moving pieces
-# [x] unsafe squares
-# [x] checks
-# [x] checkmates
-# [x] castling
-# [x] en passant
-# [x] pawn promotion
-
-def draw(board:Board, legal_moves:list[list[int]]) -> None:
-    board.DrawBoard()
-    board.DrawSelectedSquares(legal_moves)
-    board.DrawPieces()
-    pygame.display.update()
-
-def main():
-    run = True
-    clock = pygame.time.Clock()
-    board = Board(WIN, IMAGES)
-    board.TranslateFen(STARTING_FEN)
-    legal_moves = []
-    selected_piece:'Optional[Piece]' = None
-    endgame = None
-    while run:
-        clock.tick(60)
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                run = False
-                break
-
-            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                for piece in board.board:
-                    if piece.rect.collidepoint(event.pos):
-                        selected_piece = piece
-                        legal_moves = MoveManager.LegalMoves(selected_piece, board)
-            
-            if event.type == pygame.MOUSEMOTION:
-                if selected_piece is not None:
-                    selected_piece.rect.move_ip(event.rel)
-
-            if event.type == pygame.MOUSEBUTTONUP and event.button == 1:
-                endgame = MoveManager.MovePiece(selected_piece, board, legal_moves)
-                selected_piece = None
-                legal_moves = []
-
-            if isinstance(endgame, bool):
-                color = 'white' if endgame else 'black'
-                print(f'{color} won')
-                run = False
-
-        draw(board, legal_moves)
-    pygame.quit()
-
-if __name__ == '__main__':
-    main()
+from pieces import Piece
+from board import Board, MoveManager
+from movecache import MoveCache
+from profiling import timer, is_enabled
+from constants import (WIDTH,
+                       HEIGHT,
+                       SQUARE_SIZE,
+                       STARTING_FEN)
+from typing import TYPE_CHECKING, Optional
+from gamestate import GameStatus
+if TYPE_CHECKING:
+    from gui import BoardView
+
+# To Do:
+# [x] Board
+# [x] pieces
+# [x] basic legal moves
+# [x] highlighting of legal moves
+# [x] moving pieces
+# [x] unsafe squares
+# [x] checks
+# [x] checkmates
+# [x] castling
+# [x] en passant
+# [x] pawn promotion
+
+def draw(view:'BoardView', legal_moves:list[int]) -> None:
+    import pygame
+    dirty = view.DrawDirty(legal_moves)
+    if dirty:
+        with timer('draw.present'):
+            pygame.display.update(dirty)
+
+def main():
+    # pygame, the window and the piece images only load once the game actually starts,
+    # so importing this module (or any rules module) never needs a display
+    import pygame
+    from gui import BoardView
+    from sprites import SpriteAtlas
+    pygame.font.init()
+    win = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
+    pygame.display.set_caption('chess maybe 2')
+
+    run = True
+    clock = pygame.time.Clock()
+    # only the window keeps a thread working out the next position's moves ahead of the clicks
+    board = Board(MoveCache(background=True))
+    board.TranslateFen(STARTING_FEN)
+    view = BoardView(win, SpriteAtlas(), board, SQUARE_SIZE)
+    legal_moves = []
+    selected_piece:'Optional[Piece]' = None
+    endgame:'Optional[GameStatus]' = None
+    while run:
+        draw(view, legal_moves)
+        clock.tick(60)
+        # sleeps until something happens instead of redrawing an unchanged board
+        for event in [pygame.event.wait()] + pygame.event.get():
+            if event.type == pygame.QUIT:
+                run = False
+                break
+
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                view.Invalidate()
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                view.ToggleOverlay()
+                # keeps the numbers moving while nothing else happens
+                pygame.time.set_timer(pygame.USEREVENT, 500 if view.show_overlay and is_enabled() else 0)
+
+            if event.type == pygame.VIDEORESIZE:
+                win = pygame.display.get_surface()
+                win.fill((0, 0, 0))
+                pygame.display.flip()
+                view.Resize(max(min(event.w, event.h) // 8, 1), win)
+
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                selected_piece = view.PickPiece(event.pos)
+                legal_moves = MoveManager.LegalMoves(selected_piece, board)
+
+            if event.type == pygame.MOUSEMOTION:
+                if selected_piece is not None:
+                    view.DragPiece(event.rel)
+
+            if event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                endgame = MoveManager.MovePiece(selected_piece, board, legal_moves, view.DropPiece())
+                selected_piece = None
+                legal_moves = []
+
+            if endgame is not None and endgame.is_over:
+                print(f'{endgame.result} ({endgame.reason})')
+                run = False
+    pygame.quit()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+'''
+Legal move lists remembered per position, for the interactive game.
+
+Highlighting a piece, checking a dropped move and looking for checkmate all
+need the legal moves of the same position, so they're generated once per
+zobrist key and kept, the least recently used ones being dropped first.
+With background on, prefetch works them out on a background thread right
+after a move is played, so they're usually ready by the time the player
+clicks. Only the window needs that, so it's off by default and a board
+without a window never starts a thread.
+'''
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+from bitboard import Position
+from movegen import generate_moves
+
+DEFAULT_CAPACITY = 4096
+
+
+class MoveCache:
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, background: bool = False) -> None:
+        self.capacity = capacity
+        self.background = background
+        self.moves: 'OrderedDict[int, list[int]]' = OrderedDict()
+        # positions being worked out in the background, by key
+        self.pending: 'dict[int, Future]' = {}
+        self.lock = threading.Lock()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, position: Position) -> list[int]:
+        '''
+        Legal moves of position, shared with the cache so they must not be modified
+        '''
+        key = position.key
+        with self.lock:
+            moves = self.moves.get(key)
+            if moves is not None:
+                self.moves.move_to_end(key)
+                self.hits += 1
+                return moves
+            future = self.pending.get(key)
+            self.misses += 1
+        if future is not None:
+            return future.result()
+        moves = generate_moves(position)
+        self._store(key, moves)
+        return moves
+
+    def prefetch(self, position: Position) -> None:
+        '''
+        Starts working out the legal moves of position on a background thread,
+        does nothing unless the cache was made with background on
+        '''
+        if not self.background:
+            return
+        key = position.key
+        with self.lock:
+            if key in self.moves or key in self.pending:
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(1, thread_name_prefix='movecache')
+            # the caller goes on playing moves on position, so the thread gets its own copy
+            self.pending[key] = self.executor.submit(self._compute, position.copy(), key)
+
+    def _compute(self, position: Position, key: int) -> list[int]:
+        moves = generate_moves(position)
+        self._store(key, moves)
+        return moves
+
+    def _store(self, key: int, moves: list[int]) -> None:
+        with self.lock:
+            self.pending.pop(key, None)
+            self.moves[key] = moves
+            self.moves.move_to_end(key)
+            while len(self.moves) > self.capacity:
+                self.moves.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.moves.clear()
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
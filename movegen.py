@@ -0,0 +1,184 @@
+'''
+Legal move generation for the side to move of a Position.
+
+Checkers and pinned pieces are worked out once per position, and every move
+is then restricted to the squares that keep the king safe, so nothing has to
+be tried out and taken back to find out if it was legal.
+'''
+from bitboard import (Position, KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN, EMPTY,
+                      WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE,
+                      MOVE_DOUBLE_PUSH, MOVE_EN_PASSANT, MOVE_CASTLE, iter_bits, lsb)
+from attacks import (KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, BETWEEN, LINE,
+                     rook_attacks, bishop_attacks, queen_attacks)
+from profiling import profiled
+
+FULL = (1 << 64) - 1
+PROMOTIONS = (QUEEN, ROOK, BISHOP, KNIGHT)
+# indexed by color: the rank pawns promote on
+PROMOTION_RANK = (0xFF << 56, 0xFF)
+
+# (right, king start, king target, squares that must be empty, squares the king crosses)
+CASTLES = (
+    ((BLACK_KINGSIDE, 4, 6, 0x60, (5, 6)), (BLACK_QUEENSIDE, 4, 2, 0x0E, (3, 2))),
+    ((WHITE_KINGSIDE, 60, 62, 0x60 << 56, (61, 62)), (WHITE_QUEENSIDE, 60, 58, 0x0E << 56, (59, 58))),
+)
+
+
+def is_attacked(position: Position, square: int, attacker_color: int, occupied: int) -> bool:
+    '''
+    Like Position.is_square_attacked, but sliders look through the given
+    occupancy, which lets the king's own square be left out of it
+    '''
+    pieces = position.pieces
+    them = position.colors[attacker_color]
+    if PAWN_ATTACKS[1 - attacker_color][square] & pieces[PAWN] & them:
+        return True
+    if KNIGHT_ATTACKS[square] & pieces[KNIGHT] & them:
+        return True
+    if KING_ATTACKS[square] & pieces[KING] & them:
+        return True
+    queens = pieces[QUEEN]
+    if rook_attacks(square, occupied) & (pieces[ROOK] | queens) & them:
+        return True
+    return bool(bishop_attacks(square, occupied) & (pieces[BISHOP] | queens) & them)
+
+def checkers(position: Position) -> int:
+    us = position.turn
+    king = position.king_square(us)
+    if king is None:
+        return 0
+    return position.attackers_to(king, position.occupied) & position.colors[1 - us]
+
+def pinned_pieces(position: Position, king: int) -> 'dict[int, int]':
+    '''
+    Maps every pinned piece of the side to move to the line it may move along
+    '''
+    us = position.turn
+    them = 1 - us
+    pieces = position.pieces
+    occupied = position.occupied
+    enemy = position.colors[them]
+    queens = pieces[QUEEN]
+    snipers = (rook_attacks(king, 0) & (pieces[ROOK] | queens) & enemy) | \
+              (bishop_attacks(king, 0) & (pieces[BISHOP] | queens) & enemy)
+    pins = {}
+    for sniper in iter_bits(snipers):
+        blockers = BETWEEN[king][sniper] & occupied
+        if blockers and not blockers & (blockers - 1) and blockers & position.colors[us]:
+            pins[lsb(blockers)] = LINE[king][sniper]
+    return pins
+
+@profiled('movegen.generate_moves')
+def generate_moves(position: Position) -> list[int]:
+    '''
+    Every legal move for the side to move, packed as in bitboard.encode_move
+    '''
+    us = position.turn
+    them = 1 - us
+    pieces = position.pieces
+    own = position.colors[us]
+    enemy = position.colors[them]
+    occupied = own | enemy
+    king = position.king_square(us)
+    moves = []
+    if king is None:
+        return moves
+
+    # the king can't stay on the line of a slider it steps away from, so it's left out of the occupancy
+    without_king = occupied ^ (1 << king)
+    for target in iter_bits(KING_ATTACKS[king] & ~own):
+        if not is_attacked(position, target, them, without_king):
+            moves.append(king | target << 6)
+
+    checking = position.attackers_to(king, occupied) & enemy
+    if checking & (checking - 1):
+        # double check, only the king can move
+        return moves
+
+    if checking:
+        checker = lsb(checking)
+        # take the checking piece or step in between it and the king
+        allowed = checking | BETWEEN[king][checker]
+    else:
+        allowed = FULL
+        moves += _castling_moves(position, us, occupied)
+
+    pins = pinned_pieces(position, king)
+    targets = ~own & allowed
+
+    for piece_type, attack in ((KNIGHT, None), (BISHOP, bishop_attacks), (ROOK, rook_attacks), (QUEEN, queen_attacks)):
+        for start in iter_bits(pieces[piece_type] & own):
+            if attack is None:
+                reachable = KNIGHT_ATTACKS[start] & targets
+            else:
+                reachable = attack(start, occupied) & targets
+            if start in pins:
+                reachable &= pins[start]
+            for target in iter_bits(reachable):
+                moves.append(start | target << 6)
+
+    _pawn_moves(position, us, king, pins, allowed, moves)
+    return moves
+
+def _castling_moves(position: Position, us: int, occupied: int) -> list[int]:
+    moves = []
+    for right, start, target, empty, crossed in CASTLES[us]:
+        if not position.castling & right or occupied & empty:
+            continue
+        if any(is_attacked(position, square, 1 - us, occupied) for square in crossed):
+            continue
+        moves.append(start | target << 6 | MOVE_CASTLE << 15)
+    return moves
+
+def _pawn_moves(position: Position, us: int, king: int, pins: 'dict[int, int]', allowed: int, moves: list[int]) -> None:
+    enemy = position.colors[1 - us]
+    occupied = position.occupied
+    empty = ~occupied & FULL
+    pawns = position.pieces[PAWN] & position.colors[us]
+    # white pawns move towards square 0
+    step = -8 if us == 1 else 8
+    promotion_rank = PROMOTION_RANK[us]
+
+    if us == 1:
+        single = (pawns >> 8) & empty
+        double = ((single & (0xFF << 40)) >> 8) & empty
+    else:
+        single = (pawns << 8) & empty
+        double = ((single & (0xFF << 16)) << 8) & empty
+
+    for target in iter_bits(single & allowed):
+        start = target - step
+        if start in pins and not pins[start] >> target & 1:
+            continue
+        if promotion_rank >> target & 1:
+            for promotion in PROMOTIONS:
+                moves.append(start | target << 6 | promotion << 12)
+        else:
+            moves.append(start | target << 6)
+
+    for target in iter_bits(double & allowed):
+        start = target - 2 * step
+        if start in pins and not pins[start] >> target & 1:
+            continue
+        moves.append(start | target << 6 | MOVE_DOUBLE_PUSH << 15)
+
+    for start in iter_bits(pawns):
+        reachable = PAWN_ATTACKS[us][start] & enemy & allowed
+        if start in pins:
+            reachable &= pins[start]
+        for target in iter_bits(reachable):
+            if promotion_rank >> target & 1:
+                for promotion in PROMOTIONS:
+                    moves.append(start | target << 6 | promotion << 12)
+            else:
+                moves.append(start | target << 6)
+
+    en_passant = position.en_passant
+    if en_passant != EMPTY:
+        captured = en_passant - step
+        for start in iter_bits(PAWN_ATTACKS[1 - us][en_passant] & pawns):
+            # taking en passant clears two squares on one rank at once, so just look at the result
+            after = (occupied ^ (1 << start) ^ (1 << captured)) | (1 << en_passant)
+            attackers = position.attackers_to(king, after) & enemy & ~(1 << captured)
+            if not attackers:
+                moves.append(start | en_passant << 6 | MOVE_EN_PASSANT << 15)
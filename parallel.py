@@ -0,0 +1,115 @@
+'''
+Multi-core search by splitting the root moves over a pool of processes.
+
+Every iteration of the deepening hands each worker a share of the root
+moves to search to the same depth, and the best of their answers wins.
+Each worker process keeps its own Searcher (and transposition table)
+between tasks, so what it learned at one depth speeds up the next.
+'''
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import TYPE_CHECKING, Callable, Optional
+from bitboard import Position
+from movegen import generate_moves, checkers
+from search import Searcher, SearchResult, MATE, MAX_PLY, known_move
+from transposition import TranspositionTable
+if TYPE_CHECKING:
+    from book import OpeningBook
+    from endgame import EndgameTables
+
+# the searcher of the current worker process, made by _init_worker
+_searcher: Optional[Searcher] = None
+
+
+def _init_worker(hash_mb: float) -> None:
+    global _searcher
+    _searcher = Searcher(TranspositionTable(hash_mb))
+
+def _search_moves(position: Position, moves: list[int], depth: int,
+                  time_limit: Optional[float], node_limit: Optional[int]) -> SearchResult:
+    return _searcher.search(position, depth, time_limit, node_limit, root_moves=moves)
+
+
+class ParallelSearcher:
+    def __init__(self, workers: Optional[int] = None, hash_mb: float = 16, book: 'Optional[OpeningBook]' = None,
+                 tables: 'Optional[EndgameTables]' = None) -> None:
+        '''
+        hash_mb is the transposition table size of each worker, not the total,
+        the book and tables are looked at here before any work goes out
+        '''
+        self.workers = workers or os.cpu_count() or 1
+        self.book = book
+        self.tables = tables
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(hash_mb,))
+
+    def close(self) -> None:
+        self.pool.shutdown(cancel_futures=True)
+
+    def __enter__(self) -> 'ParallelSearcher':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def search(self, position: Position, max_depth: int = MAX_PLY, time_limit: Optional[float] = None,
+               node_limit: Optional[int] = None,
+               on_iteration: 'Optional[Callable[[SearchResult], None]]' = None) -> SearchResult:
+        '''
+        Same contract as Searcher.search: the result of the deepest
+        iteration where every worker finished
+        '''
+        start = time.perf_counter()
+        moves = generate_moves(position)
+        if not moves:
+            return SearchResult(None, -MATE if checkers(position) else 0, 0, 0, [], 0.0)
+        known = known_move(position, self.book, self.tables)
+        if known is not None:
+            return known
+
+        best = SearchResult(moves[0], 0, 0, 0, [moves[0]], 0.0)
+        nodes = 0
+        for depth in range(1, max_depth + 1):
+            remaining_time = None
+            if time_limit is not None:
+                remaining_time = time_limit - (time.perf_counter() - start)
+                if remaining_time <= 0:
+                    best = best._replace(timed_out=True)
+                    break
+            remaining_nodes = None
+            if node_limit is not None:
+                remaining_nodes = node_limit - nodes
+                if remaining_nodes <= 0:
+                    best = best._replace(timed_out=True)
+                    break
+
+            chunks = self._split(moves, best.best_move)
+            task_nodes = remaining_nodes // len(chunks) if remaining_nodes is not None else None
+            futures = [self.pool.submit(_search_moves, position, chunk, depth, remaining_time, task_nodes)
+                       for chunk in chunks]
+            wait(futures)
+            results = [future.result() for future in futures]
+            nodes += sum(result.nodes for result in results)
+
+            # a worker that ran out of budget didn't reach this depth, so the iteration doesn't count,
+            # one that stopped short on a mate did finish: its moves' scores can't change any more
+            if any(result.timed_out for result in results):
+                break
+            iteration = max(results, key=lambda result: result.score)
+            best = SearchResult(iteration.best_move, iteration.score, depth, nodes,
+                                iteration.pv, time.perf_counter() - start)
+            if on_iteration is not None:
+                on_iteration(best)
+
+            if abs(best.score) >= MATE - MAX_PLY:
+                break
+            if time_limit is not None and best.elapsed > time_limit / 2 and depth < max_depth:
+                best = best._replace(timed_out=True)
+                break
+        return best
+
+    def _split(self, moves: list[int], best_move: Optional[int]) -> list[list[int]]:
+        # the previous best move goes first so its worker starts on it, the rest are dealt out in turn
+        ordered = sorted(moves, key=lambda move: move != best_move)
+        chunk_count = min(self.workers, len(ordered))
+        return [ordered[index::chunk_count] for index in range(chunk_count)]
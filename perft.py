@@ -0,0 +1,168 @@
+'''
+Perft: counts the leaf nodes of the move tree to a fixed depth, which pins
+down the move generator exactly (castling, en passant and promotions
+included) and doubles as its benchmark.
+
+    python perft.py --suite                   # the bundled positions, depth 3
+    python perft.py --suite --depth 4 --min-nps 50000
+    python perft.py --batch                   # vectorized.py and evaluate_batch against the scalar code
+    python perft.py "<fen>" --depth 4 --divide
+'''
+import argparse
+import sys
+import time
+from board import ChessParser
+from bitboard import Position, move_name
+from movegen import generate_moves, checkers
+from constants import STARTING_FEN
+
+# (name, fen, node counts for depth 1, 2, ...)
+PERFT_SUITE = [
+    ('start', STARTING_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603]),
+    ('en passant pins', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238, 674624]),
+    ('promotions', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333]),
+    ('underpromotion', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379, 2103487]),
+    ('middlegame', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def perft(position: Position, depth: int) -> int:
+    '''
+    Number of leaf nodes depth moves down from the position
+    '''
+    moves = generate_moves(position)
+    if depth <= 1:
+        # the last level only needs counting, not playing
+        return len(moves) if depth == 1 else 1
+
+    nodes = 0
+    for move in moves:
+        position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move()
+    return nodes
+
+def divide(position: Position, depth: int) -> 'dict[str, int]':
+    '''
+    Perft split by root move, for finding which move a wrong count comes from
+    '''
+    counts = {}
+    for move in generate_moves(position):
+        position.make_move(move)
+        counts[move_name(move)] = perft(position, depth - 1)
+        position.unmake_move()
+    return counts
+
+def run_suite(depth: int, out=sys.stdout) -> 'tuple[bool, int, float]':
+    '''
+    Runs every suite position to depth (or as deep as its known counts go),
+    returns whether all counts matched, the total nodes and the time taken
+    '''
+    passed = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, counts in PERFT_SUITE:
+        position = ChessParser.TranslateFen(fen)
+        position_depth = min(depth, len(counts))
+        start = time.perf_counter()
+        nodes = perft(position, position_depth)
+        elapsed = time.perf_counter() - start
+        total_nodes += nodes
+        total_time += elapsed
+
+        expected = counts[position_depth - 1]
+        status = 'ok' if nodes == expected else f'FAILED (expected {expected})'
+        passed = passed and nodes == expected
+        print(f'{name:<16} depth {position_depth}  {nodes:>10} nodes  {elapsed:7.2f}s  '
+              f'{_nps(nodes, elapsed):>9} nps  {status}', file=out)
+    return passed, total_nodes, total_time
+
+def suite_positions(depth: int) -> 'list[Position]':
+    '''
+    Every position within depth - 1 moves of a suite position, the ones whose moves perft counts at depth
+    '''
+    positions = []
+
+    def visit(position: Position, remaining: int) -> None:
+        positions.append(position.copy())
+        if remaining > 1:
+            for move in generate_moves(position):
+                position.make_move(move)
+                visit(position, remaining - 1)
+                position.unmake_move()
+
+    for _, fen, _ in PERFT_SUITE:
+        visit(ChessParser.TranslateFen(fen), depth)
+    return positions
+
+def run_batch_check(depth: int, out=sys.stdout) -> bool:
+    '''
+    Checks that the NumPy batch code gives exactly the legal move counts,
+    check flags and evaluations of the scalar code on the suite positions
+    '''
+    # numpy is only needed here
+    from vectorized import stack, legal_move_counts, in_check
+    from evaluation import evaluate, evaluate_batch
+
+    positions = suite_positions(depth)
+    batch = stack(positions)
+    checks = [
+        ('legal move counts', legal_move_counts(batch), [len(generate_moves(position)) for position in positions]),
+        ('check flags', in_check(batch), [bool(checkers(position)) for position in positions]),
+        ('evaluations', evaluate_batch(batch), [evaluate(position) for position in positions]),
+    ]
+    passed = True
+    for name, batched, expected in checks:
+        wrong = [index for index, value in enumerate(expected) if batched[index] != value]
+        status = 'ok' if not wrong else f'FAILED on {len(wrong)}, first {ChessParser.ToFen(positions[wrong[0]])}'
+        passed = passed and not wrong
+        print(f'{name:<18} {len(positions):>7} positions  {status}', file=out)
+    return passed
+
+def _nps(nodes: int, elapsed: float) -> int:
+    return int(nodes / elapsed) if elapsed > 0 else 0
+
+def main(argv: 'list[str] | None' = None) -> int:
+    parser = argparse.ArgumentParser(description='Count move tree leaf nodes to check and time the move generator.')
+    parser.add_argument('fen', nargs='?', default=STARTING_FEN, help='position to count from (default: starting position)')
+    parser.add_argument('-d', '--depth', type=int, default=3)
+    parser.add_argument('--divide', action='store_true', help='show the count below every root move')
+    parser.add_argument('--suite', action='store_true', help='run the bundled positions with known counts')
+    parser.add_argument('--batch', action='store_true',
+                        help='check the NumPy batch code against the scalar code on the suite positions')
+    parser.add_argument('--min-nps', type=int, default=0, help='fail if the overall speed is below this')
+    args = parser.parse_args(argv)
+
+    if args.batch:
+        return 0 if run_batch_check(args.depth) else 1
+    if args.suite:
+        passed, nodes, elapsed = run_suite(args.depth)
+    else:
+        position = ChessParser.TranslateFen(args.fen)
+        start = time.perf_counter()
+        if args.divide:
+            counts = divide(position, args.depth)
+            for name in sorted(counts):
+                print(f'{name}: {counts[name]}')
+            nodes = sum(counts.values())
+        else:
+            nodes = perft(position, args.depth)
+        elapsed = time.perf_counter() - start
+        passed = True
+
+    nps = _nps(nodes, elapsed)
+    print(f'total {nodes} nodes in {elapsed:.2f}s, {nps} nps')
+    if args.min_nps and nps < args.min_nps:
+        print(f'too slow: {nps} nps is below {args.min_nps}')
+        passed = False
+    return 0 if passed else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
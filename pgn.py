@@ -0,0 +1,207 @@
+'''
+PGN reading and replay.
+
+Games are read one at a time from a stream, their SAN moves are matched
+against the legal moves of the position and played with make_move, and every
+game gives one JSON line: final FEN, result, number of moves played and the
+first illegal or unreadable move if there was one. Large archives can be
+spread over a process pool, the same way batch.py does it.
+
+    python pgn.py games.pgn -o results.jsonl --workers 8
+'''
+import argparse
+import json
+import os
+import re
+import sys
+from typing import Iterator, NamedTuple, Optional, TextIO
+from board import ChessParser
+from bitboard import (Position, KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN, MOVE_CASTLE,
+                      PIECE_CHARS, parse_square)
+from movegen import generate_moves
+from gamestate import game_status, position_counts
+from batch import chunked, stream_results
+from constants import STARTING_FEN
+
+GAMES_PER_CHUNK = 64
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+SAN_PIECES = {'K': KING, 'Q': QUEEN, 'R': ROOK, 'B': BISHOP, 'N': KNIGHT}
+
+TAG_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# comments, variations, move numbers and annotations are told apart from moves here
+TOKEN_PATTERN = re.compile(r'\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|\d+\.(?:\.\.)?|[^\s{}();]+')
+SAN_PATTERN = re.compile(r'^([KQRBN])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBNqrbn]))?$')
+
+
+class PgnGame(NamedTuple):
+    tags: 'dict[str, str]'
+    movetext: str
+
+
+def read_games(source: TextIO) -> Iterator[PgnGame]:
+    '''
+    Yields the games of a PGN stream one at a time, only one game is held in memory
+    '''
+    tags = {}
+    movetext: list[str] = []
+    # brace comments can run over several lines, a [ inside one doesn't start a new game
+    open_comment = False
+    for line in source:
+        stripped = line.strip()
+        if not open_comment and stripped.startswith('['):
+            if movetext:
+                yield PgnGame(tags, ''.join(movetext))
+                tags, movetext = {}, []
+            match = TAG_PATTERN.match(stripped)
+            if match:
+                tags[match.group(1)] = match.group(2).replace('\\"', '"')
+            continue
+        if stripped.startswith('%'):
+            # escaped line, ignored by PGN readers
+            continue
+        if stripped or movetext:
+            movetext.append(line)
+            open_comment = _ends_in_comment(line, open_comment)
+    if tags or any(line.strip() for line in movetext):
+        yield PgnGame(tags, ''.join(movetext))
+
+def _ends_in_comment(line: str, open_comment: bool) -> bool:
+    for character in line:
+        if character == '{':
+            open_comment = True
+        elif character == '}':
+            open_comment = False
+        elif character == ';' and not open_comment:
+            break
+    return open_comment
+
+def san_moves(movetext: str) -> 'Iterator[str]':
+    '''
+    The main line moves of a movetext, leaving out comments, variations,
+    move numbers, annotation glyphs and the result
+    '''
+    depth = 0
+    for token in TOKEN_PATTERN.findall(movetext):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth = max(depth - 1, 0)
+        elif depth or token[0] in '{;$' or token in RESULTS or token[0].isdigit() and token.endswith('.'):
+            continue
+        else:
+            yield token
+
+def parse_san(position: Position, san: str, moves: Optional[list[int]] = None) -> int:
+    '''
+    Finds the legal move a SAN string stands for, raises ValueError if there
+    is none or more than one
+    '''
+    if moves is None:
+        moves = generate_moves(position)
+    text = san.rstrip('+#!?')
+
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        file = 6 if len(text) == 3 else 2
+        for move in moves:
+            if move >> 15 & 3 == MOVE_CASTLE and (move >> 6 & 63) & 7 == file:
+                return move
+        raise ValueError(f'illegal castling {san}')
+
+    match = SAN_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f'unreadable move {san!r}')
+    piece, from_file, from_rank, target, promotion = match.groups()
+    piece_type = SAN_PIECES[piece] if piece else PAWN
+    target_square = parse_square(target)
+    promotion_type = PIECE_CHARS.index(promotion.lower()) if promotion else 0
+
+    found = []
+    for move in moves:
+        start = move & 63
+        if move >> 6 & 63 != target_square or position.squares[start] % 6 != piece_type:
+            continue
+        if move >> 12 & 7 != promotion_type or move >> 15 & 3 == MOVE_CASTLE:
+            continue
+        if from_file is not None and 'abcdefgh'[start & 7] != from_file:
+            continue
+        if from_rank is not None and str(8 - (start >> 3)) != from_rank:
+            continue
+        found.append(move)
+
+    if len(found) != 1:
+        raise ValueError(f'{"ambiguous" if found else "illegal"} move {san}')
+    return found[0]
+
+def replay_game(game: PgnGame) -> dict:
+    '''
+    Plays a game through the rules and reports where it ended up, stopping at
+    the first move that can't be played
+    '''
+    result = {
+        'white': game.tags.get('White', '?'),
+        'black': game.tags.get('Black', '?'),
+        'result': game.tags.get('Result', '*'),
+    }
+    try:
+        position = ChessParser.TranslateFen(game.tags.get('FEN', STARTING_FEN))
+    except ValueError as error:
+        result['error'] = f'bad FEN tag: {error}'
+        return result
+
+    plies = 0
+    for san in san_moves(game.movetext):
+        try:
+            move = parse_san(position, san)
+        except ValueError as error:
+            result['error'] = str(error)
+            result['error_ply'] = plies + 1
+            break
+        position.make_move(move)
+        plies += 1
+
+    result['plies'] = plies
+    result['fen'] = ChessParser.ToFen(position)
+    if 'error' not in result:
+        status = game_status(position, position_counts(position))
+        if status.is_over:
+            result['termination'] = status.reason
+    return result
+
+def replay_chunk(games: 'list[tuple[int, PgnGame]]') -> list[str]:
+    output = []
+    for number, game in games:
+        result = {'game': number}
+        result.update(replay_game(game))
+        output.append(json.dumps(result))
+    return output
+
+def run(source: TextIO, out: TextIO, workers: int = 1, chunk_size: int = GAMES_PER_CHUNK) -> int:
+    '''
+    Replays every game of source and writes one JSON line per game to out,
+    returns how many games were written
+    '''
+    games = enumerate(read_games(source), 1)
+    return stream_results(replay_chunk, chunked(games, chunk_size), out, workers)
+
+def main(argv: 'list[str] | None' = None) -> int:
+    parser = argparse.ArgumentParser(description='Replay and validate every game of a PGN file.')
+    parser.add_argument('input', help='PGN file, - for stdin')
+    parser.add_argument('-o', '--output', default='-', help='JSON lines output file, - for stdout')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=GAMES_PER_CHUNK)
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == '-' else open(args.input)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        count = run(source, out, args.workers, args.chunk_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    print(f'{count} games replayed', file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
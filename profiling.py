@@ -0,0 +1,170 @@
+'''
+Opt-in timing of the rules and drawing code.
+
+Functions decorated with profiled and blocks run under timer() count their
+calls and put their latencies into a histogram, but only once profiling is
+turned on, either with enable() or by starting with CHESS_PROFILE=1 in the
+environment. With CHESS_PROFILE_OUT=stats.json the numbers are also written
+there as JSON when the process exits, for runs without a window.
+
+    CHESS_PROFILE=1 python main.py              (F3 toggles the overlay)
+    CHESS_PROFILE_OUT=stats.json python pgn.py games.pgn -w 1
+'''
+import atexit
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+# upper bounds of the histogram buckets in microseconds, the last bucket holds everything slower
+BUCKET_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+# 'le_100' counts the calls that took more than 50us and at most 100us
+BUCKET_LABELS = tuple(f'le_{bound}' for bound in BUCKET_BOUNDS) + ('inf',)
+
+_enabled = False
+_histograms: 'dict[str, Histogram]' = {}
+# the move cache records from its prefetch thread while the main thread records and draws the overlay
+_lock = threading.Lock()
+
+
+class Histogram:
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, seconds * 1e6)] += 1
+
+    def percentile(self, fraction: float) -> float:
+        '''
+        Upper bound in seconds of the bucket the given fraction of calls falls in
+        '''
+        if not self.count:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min(BUCKET_BOUNDS[index] / 1e6, self.max) if index < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1e3,
+            'mean_us': self.total / self.count * 1e6 if self.count else 0.0,
+            'min_us': self.min * 1e6 if self.count else 0.0,
+            'max_us': self.max * 1e6,
+            'p50_us': self.percentile(0.5) * 1e6,
+            'p99_us': self.percentile(0.99) * 1e6,
+            'buckets': {label: count for label, count in zip(BUCKET_LABELS, self.buckets) if count},
+        }
+
+
+def enable(out: Optional[str] = None) -> None:
+    '''
+    Starts recording, out is a JSON file the stats get written to at exit
+    '''
+    global _enabled
+    _enabled = True
+    if out is not None:
+        atexit.register(dump, out)
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+def is_enabled() -> bool:
+    return _enabled
+
+def reset() -> None:
+    with _lock:
+        _histograms.clear()
+
+def record(name: str, seconds: float) -> None:
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(seconds)
+
+def profiled(name: str) -> Callable:
+    '''
+    Decorator timing every call of a function under name while profiling is on
+    '''
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        record(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+def timer(name: str) -> '_Timer | _NullTimer':
+    '''
+    Context manager timing a block under name while profiling is on
+    '''
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+def stats() -> 'dict[str, dict]':
+    with _lock:
+        return {name: histogram.to_dict() for name, histogram in sorted(_histograms.items())}
+
+def summary_lines() -> list[str]:
+    '''
+    One short line per timed name, for the overlay
+    '''
+    lines = []
+    with _lock:
+        for name, histogram in sorted(_histograms.items()):
+            mean = histogram.total / histogram.count * 1e6
+            lines.append(f'{name}: {histogram.count}x  mean {mean:.0f}us  '
+                         f'p99 {histogram.percentile(0.99) * 1e6:.0f}us  max {histogram.max * 1e6:.0f}us')
+    return lines
+
+def dump(path: str) -> None:
+    with open(path, 'w') as file:
+        json.dump(stats(), file, indent=2)
+
+
+if os.environ.get('CHESS_PROFILE') or os.environ.get('CHESS_PROFILE_OUT'):
+    enable(os.environ.get('CHESS_PROFILE_OUT'))
@@ -0,0 +1,105 @@
+'''
+Material and piece-square values for the evaluation.
+
+The tables are from white's side with a8 first, the same order as the
+square indices, and black reads them mirrored. PST_MG and PST_EG fold the
+material value in and carry the sign of the piece's color (white positive),
+so Position can keep the sum over its pieces up to date with one addition
+per piece it puts down or picks up.
+'''
+
+# middlegame and endgame values in 'kqrbnp' order, the king's being irrelevant
+MG_VALUES = (0, 900, 500, 330, 320, 100)
+EG_VALUES = (0, 950, 540, 320, 300, 120)
+
+KING_MG = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20,
+)
+KING_EG = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+)
+QUEEN_TABLE = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+)
+ROOK_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0,
+)
+BISHOP_TABLE = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+)
+KNIGHT_TABLE = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+)
+PAWN_MG = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+)
+# in the endgame a pawn is worth more the closer it gets to promoting
+PAWN_EG = tuple(value for value in (0, 80, 50, 30, 15, 5, 0, 0) for _ in range(8))
+
+MG_TABLES = (KING_MG, QUEEN_TABLE, ROOK_TABLE, BISHOP_TABLE, KNIGHT_TABLE, PAWN_MG)
+EG_TABLES = (KING_EG, QUEEN_TABLE, ROOK_TABLE, BISHOP_TABLE, KNIGHT_TABLE, PAWN_EG)
+
+
+def _signed_tables(values: 'tuple[int, ...]', tables: 'tuple[tuple[int, ...], ...]') -> 'list[list[int]]':
+    # indexed by color * 6 + piece_type like Position.squares, black being 0
+    signed = []
+    for color in range(2):
+        for piece_type in range(6):
+            table = tables[piece_type]
+            if color == 1:
+                signed.append([values[piece_type] + table[square] for square in range(64)])
+            else:
+                signed.append([-values[piece_type] - table[square ^ 56] for square in range(64)])
+    return signed
+
+PST_MG = _signed_tables(MG_VALUES, MG_TABLES)
+PST_EG = _signed_tables(EG_VALUES, EG_TABLES)
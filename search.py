@@ -0,0 +1,376 @@
+'''
+Negamax alpha-beta search on a Position, with iterative deepening,
+quiescence search and a time and node budget.
+
+Results are kept in a TranspositionTable, which gives cutoffs for positions
+reached again and a best move to try first. After that, moves are ordered
+with the principal variation of the previous iteration first, then captures by MVV-LVA (most valuable victim, least valuable
+attacker), promotions, two killer moves per ply and the history heuristic.
+
+    python search.py "<fen>" --time 2
+'''
+import argparse
+import sys
+import time
+from typing import TYPE_CHECKING, Callable, NamedTuple, Optional
+from bitboard import Position, EMPTY, PAWN, MOVE_EN_PASSANT, move_name
+from movegen import generate_moves, checkers
+from evaluation import evaluate
+from transposition import TranspositionTable, BOUND_EXACT, BOUND_LOWER, BOUND_UPPER
+from board import ChessParser
+from constants import STARTING_FEN
+if TYPE_CHECKING:
+    from book import OpeningBook
+    from endgame import EndgameTables
+
+INFINITY = 1_000_000
+MATE = 100_000
+MAX_PLY = 128
+# for move ordering, by piece type ('kqrbnp'), the king is never captured so it's worth nothing here
+PIECE_VALUES = (0, 900, 500, 330, 320, 100)
+
+# move ordering buckets, higher is searched first
+PV_BONUS = 4_000_000
+CAPTURE_BONUS = 2_000_000
+PROMOTION_BONUS = 1_500_000
+KILLER_BONUS = 1_000_000
+HISTORY_LIMIT = 500_000
+
+
+class SearchResult(NamedTuple):
+    best_move: Optional[int]
+    # centipawns from the side to move's point of view, mates are close to +-MATE
+    score: int
+    depth: int
+    nodes: int
+    pv: list[int]
+    elapsed: float
+    # the time or node budget ran out before max_depth was reached
+    timed_out: bool = False
+
+
+class SearchTimeout(Exception):
+    '''
+    Raised inside the search when the time or node budget runs out
+    '''
+
+
+def score_to_table(score: int, ply: int) -> int:
+    # mates are stored as distance from the stored position, not from the root
+    if score >= MATE - MAX_PLY:
+        return score + ply
+    if score <= -MATE + MAX_PLY:
+        return score - ply
+    return score
+
+def score_from_table(score: int, ply: int) -> int:
+    if score >= MATE - MAX_PLY:
+        return score - ply
+    if score <= -MATE + MAX_PLY:
+        return score + ply
+    return score
+
+def known_move(position: Position, book: 'Optional[OpeningBook]' = None,
+               tables: 'Optional[EndgameTables]' = None) -> Optional[SearchResult]:
+    '''
+    The book move of position, or its table move when it's in the endgame
+    tables, as a result that needs no search; None when neither knows it
+    '''
+    if book is not None:
+        move = book.choose(position)
+        if move is not None:
+            return SearchResult(move, 0, 0, 0, [move], 0.0)
+    if tables is not None:
+        result = tables.probe(position)
+        if result is not None:
+            move = tables.best_move(position)
+            if move is not None:
+                score = result.wdl * (MATE - result.plies) if result.wdl else 0
+                return SearchResult(move, score, 0, 0, [move], 0.0)
+    return None
+
+def is_repetition(position: Position) -> bool:
+    '''
+    Whether the position already happened since the last capture or pawn move
+    '''
+    key = position.key
+    history = position.history
+    # history[i] keeps the key from before move i, so history[-2] is the last position with this side to move
+    oldest = max(len(history) - position.halfmove, 0)
+    for index in range(len(history) - 2, oldest - 1, -2):
+        if history[index][5] == key:
+            return True
+    return False
+
+
+class Searcher:
+    def __init__(self, table: Optional[TranspositionTable] = None, book: 'Optional[OpeningBook]' = None,
+                 tables: 'Optional[EndgameTables]' = None) -> None:
+        # can be shared between searches (and searchers) to keep what was learned
+        self.table = table if table is not None else TranspositionTable()
+        # looked at before searching, a move from them is played without a search
+        self.book = book
+        self.tables = tables
+        self.nodes = 0
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        # indexed by color, then start * 64 + target
+        self.history = [[0] * 4096 for _ in range(2)]
+        self.pv_line: list[int] = []
+        self.deadline: Optional[float] = None
+        self.node_limit: Optional[int] = None
+        self.root_moves: Optional[list[int]] = None
+
+    def search(self, position: Position, max_depth: int = MAX_PLY, time_limit: Optional[float] = None,
+               node_limit: Optional[int] = None,
+               on_iteration: 'Optional[Callable[[SearchResult], None]]' = None,
+               root_moves: Optional[list[int]] = None) -> SearchResult:
+        '''
+        Searches one ply deeper each iteration until max_depth or the budget
+        runs out, and returns the result of the last iteration that finished.
+        The position is left as it was given, even when the search is cut off.
+        root_moves limits the search to some of the moves of the position,
+        which is how the parallel search splits up the work.
+        '''
+        start = time.perf_counter()
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.node_limit = node_limit
+        self.nodes = 0
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        self.history = [[value // 2 for value in table] for table in self.history]
+        self.pv_line = []
+        self.table.new_search()
+        self.root_moves = root_moves
+
+        moves = self._root_filter(generate_moves(position))
+        if not moves:
+            score = -MATE if checkers(position) else 0
+            return SearchResult(None, score, 0, 0, [], 0.0)
+        if root_moves is None:
+            known = known_move(position, self.book, self.tables)
+            if known is not None:
+                return known
+
+        # always have a move to give back, even if the first iteration doesn't finish
+        best = SearchResult(moves[0], 0, 0, 0, [moves[0]], 0.0)
+        root_length = len(position.history)
+        for depth in range(1, max_depth + 1):
+            try:
+                score, pv = self._negamax(position, depth, -INFINITY, INFINITY, 0)
+            except SearchTimeout:
+                while len(position.history) > root_length:
+                    position.unmake_move()
+                best = best._replace(timed_out=True)
+                break
+
+            elapsed = time.perf_counter() - start
+            best = SearchResult(pv[0] if pv else moves[0], score, depth, self.nodes, pv, elapsed)
+            self.pv_line = pv
+            if on_iteration is not None:
+                on_iteration(best)
+
+            if abs(score) >= MATE - MAX_PLY:
+                break
+            # the next iteration takes several times longer than this one, don't start what can't finish
+            if time_limit is not None and elapsed > time_limit / 2 and depth < max_depth:
+                best = best._replace(timed_out=True)
+                break
+        return best
+
+    def _root_filter(self, moves: list[int]) -> list[int]:
+        if self.root_moves is None:
+            return moves
+        return [move for move in moves if move in self.root_moves]
+
+    def _tick(self) -> None:
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            if self.deadline is not None and time.perf_counter() > self.deadline:
+                raise SearchTimeout()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+
+    def _negamax(self, position: Position, depth: int, alpha: int, beta: int, ply: int) -> 'tuple[int, list[int]]':
+        self._tick()
+        if ply > 0 and (position.halfmove >= 100 or is_repetition(position)):
+            return 0, []
+
+        in_check = checkers(position)
+        if in_check:
+            # don't let a check push a threat past the horizon
+            depth += 1
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self._quiescence(position, alpha, beta, ply), []
+
+        original_alpha = alpha
+        hash_move = 0
+        entry = self.table.probe(position.key)
+        if entry is not None:
+            hash_move = entry.move
+            if ply > 0 and entry.depth >= depth:
+                score = score_from_table(entry.score, ply)
+                if entry.bound == BOUND_EXACT or \
+                   (entry.bound == BOUND_LOWER and score >= beta) or \
+                   (entry.bound == BOUND_UPPER and score <= alpha):
+                    return score, []
+
+        moves = generate_moves(position)
+        if not moves:
+            return (-MATE + ply if in_check else 0), []
+        if ply == 0:
+            moves = self._root_filter(moves)
+
+        pv_move = hash_move or (self.pv_line[ply] if ply < len(self.pv_line) else 0)
+        self._order(position, moves, pv_move, ply)
+
+        best_score = -INFINITY
+        best_move = 0
+        best_pv: list[int] = []
+        for move in moves:
+            position.make_move(move)
+            score, child_pv = self._negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            position.unmake_move()
+            score = -score
+
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    best_move = move
+                    best_pv = [move] + child_pv
+                    if alpha >= beta:
+                        if self._is_quiet(position, move):
+                            self._store_killer(move, ply)
+                            self._add_history(position.turn, move, depth)
+                        break
+
+        if best_score >= beta:
+            bound = BOUND_LOWER
+        elif best_score > original_alpha:
+            bound = BOUND_EXACT
+        else:
+            bound = BOUND_UPPER
+        self.table.store(position.key, depth, bound, score_to_table(best_score, ply), best_move)
+        return best_score, best_pv
+
+    def _quiescence(self, position: Position, alpha: int, beta: int, ply: int) -> int:
+        '''
+        Plays out captures and promotions until the position is quiet, so the
+        evaluation never lands in the middle of an exchange
+        '''
+        self._tick()
+        in_check = checkers(position)
+        best_score = -INFINITY
+        if not in_check:
+            best_score = evaluate(position)
+            if best_score >= beta or ply >= MAX_PLY - 1:
+                return best_score
+            alpha = max(alpha, best_score)
+
+        moves = generate_moves(position)
+        if not moves:
+            return -MATE + ply if in_check else 0
+        if not in_check:
+            moves = [move for move in moves if not self._is_quiet(position, move)]
+        self._order(position, moves, 0, ply)
+
+        for move in moves:
+            position.make_move(move)
+            score = -self._quiescence(position, -beta, -alpha, ply + 1)
+            position.unmake_move()
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best_score
+
+    @staticmethod
+    def _is_quiet(position: Position, move: int) -> bool:
+        return position.squares[move >> 6 & 63] == EMPTY and not move >> 12 & 7 and move >> 15 & 3 != MOVE_EN_PASSANT
+
+    def _order(self, position: Position, moves: list[int], pv_move: int, ply: int) -> None:
+        squares = position.squares
+        killers = self.killers[ply] if ply < MAX_PLY else [0, 0]
+        history = self.history[position.turn]
+        scores = {}
+        for move in moves:
+            target = move >> 6 & 63
+            victim = squares[target]
+            if move == pv_move:
+                score = PV_BONUS
+            elif victim != EMPTY or move >> 15 & 3 == MOVE_EN_PASSANT:
+                victim_type = PAWN if victim == EMPTY else victim % 6
+                attacker_type = squares[move & 63] % 6
+                score = CAPTURE_BONUS + PIECE_VALUES[victim_type] * 16 - PIECE_VALUES[attacker_type] // 10
+            elif move >> 12 & 7:
+                score = PROMOTION_BONUS + PIECE_VALUES[move >> 12 & 7]
+            elif move == killers[0]:
+                score = KILLER_BONUS + 1
+            elif move == killers[1]:
+                score = KILLER_BONUS
+            else:
+                score = history[move & 4095]
+            scores[move] = score
+        moves.sort(key=scores.__getitem__, reverse=True)
+
+    def _store_killer(self, move: int, ply: int) -> None:
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+    def _add_history(self, color: int, move: int, depth: int) -> None:
+        history = self.history[color]
+        index = move & 4095
+        history[index] += depth * depth
+        if history[index] > HISTORY_LIMIT:
+            self.history[color] = [value // 2 for value in history]
+
+
+def main(argv: 'list[str] | None' = None) -> int:
+    parser = argparse.ArgumentParser(description='Search a position for the best move.')
+    parser.add_argument('fen', nargs='?', default=STARTING_FEN)
+    parser.add_argument('-d', '--depth', type=int, default=MAX_PLY)
+    parser.add_argument('-t', '--time', type=float, default=None, help='seconds to think')
+    parser.add_argument('-n', '--nodes', type=int, default=None, help='nodes to search')
+    parser.add_argument('--hash', type=float, default=16, help='transposition table size in MB')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='processes to split the root moves over')
+    parser.add_argument('--book', default=None, help='opening book to play from before searching')
+    parser.add_argument('--tables', default=None, help='directory of endgame tables to play from before searching')
+    args = parser.parse_args(argv)
+    if args.time is None and args.nodes is None and args.depth == MAX_PLY:
+        args.time = 5.0
+
+    def report(result: SearchResult) -> None:
+        print(f'depth {result.depth} score {result.score} nodes {result.nodes} '
+              f'time {result.elapsed:.2f} pv {" ".join(map(move_name, result.pv))}')
+
+    position = ChessParser.TranslateFen(args.fen)
+    # imported here, the book reads games with pgn.py which builds on this module
+    book = tables = None
+    if args.book is not None:
+        from book import OpeningBook
+        book = OpeningBook(args.book)
+    if args.tables is not None:
+        from endgame import EndgameTables
+        tables = EndgameTables(args.tables)
+    try:
+        if args.workers > 1:
+            # imported here, parallel.py builds on this module
+            from parallel import ParallelSearcher
+            with ParallelSearcher(args.workers, args.hash, book, tables) as searcher:
+                result = searcher.search(position, args.depth, args.time, args.nodes, report)
+        else:
+            searcher = Searcher(TranspositionTable(args.hash), book, tables)
+            result = searcher.search(position, args.depth, args.time, args.nodes, report)
+    finally:
+        if book is not None:
+            book.close()
+        if tables is not None:
+            tables.close()
+    print(f'bestmove {move_name(result.best_move) if result.best_move is not None else "(none)"}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
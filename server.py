@@ -0,0 +1,282 @@
+'''
+Hosts many games at once for programs talking JSON lines over a local socket.
+
+Every request is one JSON object on a line and gets one JSON object back,
+with the request's id copied over so a client can have several requests
+out at a time:
+
+    {"id": 1, "cmd": "new"}                         -> {"id": 1, "ok": true, "game": 1, "fen": ...}
+    {"id": 2, "cmd": "move", "game": 1, "move": "e2e4"}
+    {"id": 3, "cmd": "search", "game": 1, "time": 0.5, "play": true}
+    {"id": 4, "cmd": "close", "game": 1}
+
+The other commands are moves, undo, state and games. A failed request
+answers {"ok": false, "error": ...}. Games belong to the server, not to a
+connection, so two clients can play the same game by its number.
+
+Looking up moves and playing them is quick and happens on the event loop.
+Searches go to a pool of worker processes with a copy of the position, so
+one long search doesn't hold up the other games. Requests for the same game
+are handled one at a time, in the order they came in.
+
+    python server.py --port 7070 --workers 4
+'''
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from bitboard import Position, move_name
+from board import Board
+from movecache import MoveCache
+from search import Searcher, SearchResult, MAX_PLY, known_move
+from transposition import TranspositionTable
+from book import OpeningBook
+from endgame import EndgameTables
+from constants import STARTING_FEN
+
+DEFAULT_PORT = 7070
+DEFAULT_MAX_GAMES = 1000
+# seconds to search when a request gives no limit
+DEFAULT_SEARCH_TIME = 1.0
+# longest request line in bytes
+LINE_LIMIT = 1 << 16
+
+# the searcher of the current worker process, made on first use
+_searcher: Optional[Searcher] = None
+
+
+def _search(position: Position, depth: int, time_limit: Optional[float], node_limit: Optional[int],
+            hash_mb: float) -> SearchResult:
+    global _searcher
+    if _searcher is None:
+        _searcher = Searcher(TranspositionTable(hash_mb))
+    return _searcher.search(position, depth, time_limit, node_limit)
+
+
+class RequestError(Exception):
+    '''
+    A request that can't be carried out, its message goes back to the client
+    '''
+
+
+class Game:
+    def __init__(self, board: Board) -> None:
+        self.board = board
+        # one request at a time per game, a search result must not go stale under a move
+        self.lock = asyncio.Lock()
+
+    def state(self) -> dict:
+        status = self.board.Status()
+        return {'fen': self.board.ToFen(), 'result': status.result, 'reason': status.reason}
+
+
+class GameServer:
+    def __init__(self, workers: Optional[int] = None, hash_mb: float = 16,
+                 max_games: int = DEFAULT_MAX_GAMES, book: Optional[OpeningBook] = None,
+                 tables: Optional[EndgameTables] = None) -> None:
+        '''
+        hash_mb is the transposition table size of each search worker,
+        the book and tables are looked at before a search goes to a worker
+        '''
+        self.workers = workers or os.cpu_count() or 1
+        self.hash_mb = hash_mb
+        self.max_games = max_games
+        self.book = book
+        self.tables = tables
+        self.games: 'dict[int, Game]' = {}
+        self.next_game = 1
+        # one legal move cache for every board, worked out on demand without a prefetch thread
+        self.move_cache = MoveCache(capacity=64 * 1024)
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        self.move_cache.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT) -> None:
+        server = await asyncio.start_server(self.serve_client, host, port, limit=LINE_LIMIT)
+        async with server:
+            await server.serve_forever()
+
+    async def serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        tasks: 'set[asyncio.Task]' = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # longer than LINE_LIMIT, there's no telling where the next request starts
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                # every request runs on its own, so a search doesn't hold up the connection's other games
+                task = asyncio.create_task(self._answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _answer(self, line: bytes, writer: asyncio.StreamWriter) -> None:
+        response = await self.handle_line(line)
+        if writer.is_closing():
+            return
+        writer.write(json.dumps(response).encode() + b'\n')
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def handle_line(self, line: bytes) -> dict:
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            return {'ok': False, 'error': f'bad json: {error}'}
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': 'a request is a json object'}
+        response = {'id': request['id']} if 'id' in request else {}
+        try:
+            response.update(await self.handle(request))
+            response['ok'] = True
+        except RequestError as error:
+            response.update(ok=False, error=str(error))
+        except Exception as error:
+            # a bug shouldn't leave the client waiting for an answer that never comes
+            response.update(ok=False, error=f'internal error: {type(error).__name__}: {error}')
+        return response
+
+    async def handle(self, request: dict) -> dict:
+        '''
+        Carries out one request, raises RequestError when it can't
+        '''
+        command = request.get('cmd')
+        if command == 'new':
+            return self.new_game(request.get('fen', STARTING_FEN))
+        if command == 'games':
+            return {'games': sorted(self.games)}
+
+        game_id = request.get('game')
+        game = self.games.get(game_id) if isinstance(game_id, int) else None
+        if game is None:
+            raise RequestError(f'no game {game_id}')
+        async with game.lock:
+            # a close may have gone through while this request waited its turn
+            if self.games.get(game_id) is not game:
+                raise RequestError(f'no game {game_id}')
+            if command == 'state':
+                return game.state()
+            if command == 'moves':
+                return {'moves': [move_name(move) for move in game.board.GenerateMoves()]}
+            if command == 'move':
+                return self.play(game, request.get('move'))
+            if command == 'undo':
+                if not game.board.position.history:
+                    raise RequestError('no move to take back')
+                move = game.board.unmake_move()
+                return {'undone': move_name(move), **game.state()}
+            if command == 'search':
+                return await self.search(game, request)
+            if command == 'close':
+                del self.games[game_id]
+                return {}
+        raise RequestError(f'unknown command {command!r}')
+
+    def new_game(self, fen: object) -> dict:
+        if not isinstance(fen, str):
+            raise RequestError('fen has to be a string')
+        if len(self.games) >= self.max_games:
+            raise RequestError(f'already hosting {self.max_games} games')
+        board = Board(self.move_cache)
+        try:
+            board.TranslateFen(fen)
+        except ValueError as error:
+            raise RequestError(str(error))
+        game_id = self.next_game
+        self.next_game += 1
+        game = self.games[game_id] = Game(board)
+        return {'game': game_id, **game.state()}
+
+    def play(self, game: Game, name: object) -> dict:
+        board = game.board
+        if board.Status().is_over:
+            raise RequestError('the game is over')
+        for move in board.GenerateMoves():
+            if move_name(move) == name:
+                board.make_move(move)
+                return game.state()
+        raise RequestError(f'illegal move {name!r}')
+
+    async def search(self, game: Game, request: dict) -> dict:
+        board = game.board
+        if board.Status().is_over:
+            raise RequestError('the game is over')
+        depth = request.get('depth') or MAX_PLY
+        time_limit = request.get('time')
+        node_limit = request.get('nodes')
+        if time_limit is None and node_limit is None and depth == MAX_PLY:
+            time_limit = DEFAULT_SEARCH_TIME
+        if not isinstance(depth, int) or not isinstance(node_limit, (int, type(None))) \
+           or not isinstance(time_limit, (int, float, type(None))):
+            raise RequestError('depth and nodes are whole numbers, time is in seconds')
+
+        # a book or table move is a lookup, only a real search goes to a worker
+        result = known_move(board.position, self.book, self.tables)
+        if result is None:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.workers)
+            loop = asyncio.get_running_loop()
+            # the worker gets a pickled copy, the board here stays as it is
+            result = await loop.run_in_executor(self.pool, _search, board.position, min(depth, MAX_PLY),
+                                                time_limit, node_limit, self.hash_mb)
+        response = {
+            'bestmove': move_name(result.best_move) if result.best_move is not None else None,
+            'score': result.score,
+            'depth': result.depth,
+            'nodes': result.nodes,
+            'pv': [move_name(move) for move in result.pv],
+        }
+        if request.get('play') and result.best_move is not None:
+            board.make_move(result.best_move)
+            response.update(game.state())
+        return response
+
+
+def main(argv: 'list[str] | None' = None) -> int:
+    parser = argparse.ArgumentParser(description='Host chess games over a local socket.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-w', '--workers', type=int, default=None, help='search processes, one per core by default')
+    parser.add_argument('--hash', type=float, default=16, help='transposition table size per worker in MB')
+    parser.add_argument('--max-games', type=int, default=DEFAULT_MAX_GAMES)
+    parser.add_argument('--book', default=None, help='opening book to play from before searching')
+    parser.add_argument('--tables', default=None, help='directory of endgame tables to play from before searching')
+    args = parser.parse_args(argv)
+
+    book = OpeningBook(args.book) if args.book is not None else None
+    tables = EndgameTables(args.tables) if args.tables is not None else None
+    server = GameServer(args.workers, args.hash, args.max_games, book, tables)
+    print(f'listening on {args.host}:{args.port}', file=sys.stderr)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if book is not None:
+            book.close()
+        if tables is not None:
+            tables.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+'''
+Piece sprites, rasterized once per square size into a single atlas surface.
+
+Parsing the 12 SVGs is most of the startup time, so a finished atlas is
+saved as a PNG named after the square size and a hash of the SVG files,
+and loaded from there the next time. Editing an SVG changes the hash, so a
+stale atlas is never used. The atlas for a new size is only made when
+something is drawn at that size, so resizing the window just drops it.
+'''
+import hashlib
+import os
+import pygame
+from typing import Optional
+
+SVG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pieces_svgs')
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.sprite_cache')
+# atlas rows are the svg file prefixes: 0 for white, 1 for black, columns are the piece types
+ROWS, COLUMNS = 2, 6
+
+
+def svg_paths(svg_dir: str = SVG_DIR) -> list[str]:
+    return [os.path.join(svg_dir, f'piece_{row}{column}.svg') for row in range(ROWS) for column in range(COLUMNS)]
+
+def svg_hash(paths: list[str]) -> str:
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+
+class SpriteAtlas:
+    def __init__(self, svg_dir: str = SVG_DIR, cache_dir: Optional[str] = CACHE_DIR) -> None:
+        '''
+        cache_dir None keeps atlases in memory only
+        '''
+        self.paths = svg_paths(svg_dir)
+        self.hash = svg_hash(self.paths)
+        self.cache_dir = cache_dir
+        self.size = 0
+        self.surface: Optional[pygame.Surface] = None
+        self.rects: list[pygame.Rect] = []
+
+    def CachePath(self, size: int) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, f'atlas_{size}_{self.hash}.png')
+
+    def Resize(self, size: int) -> None:
+        '''
+        Switches to another square size, the atlas is made on the next blit
+        '''
+        if size != self.size:
+            self.size = size
+            self.surface = None
+
+    def Atlas(self) -> pygame.Surface:
+        if self.surface is None:
+            self.surface = self.Load(self.size)
+            self.rects = [pygame.Rect(column * self.size, row * self.size, self.size, self.size)
+                          for row in range(ROWS) for column in range(COLUMNS)]
+        return self.surface
+
+    def Load(self, size: int) -> pygame.Surface:
+        path = self.CachePath(size)
+        if path is not None and os.path.exists(path):
+            try:
+                atlas = pygame.image.load(path)
+                if atlas.get_size() == (COLUMNS * size, ROWS * size):
+                    return self.Convert(atlas)
+            except pygame.error:
+                pass
+        atlas = self.Rasterize(size)
+        if path is not None:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # written next to the final name and renamed, so a half written file is never loaded
+                temporary = f'{path}.{os.getpid()}.png'
+                pygame.image.save(atlas, temporary)
+                os.replace(temporary, path)
+            except (OSError, pygame.error):
+                pass
+        return self.Convert(atlas)
+
+    def Rasterize(self, size: int) -> pygame.Surface:
+        atlas = pygame.Surface((COLUMNS * size, ROWS * size), pygame.SRCALPHA)
+        for index, path in enumerate(self.paths):
+            image = pygame.transform.smoothscale(pygame.image.load(path), (size, size))
+            atlas.blit(image, ((index % COLUMNS) * size, (index // COLUMNS) * size))
+        return atlas
+
+    @staticmethod
+    def Convert(atlas: pygame.Surface) -> pygame.Surface:
+        # matching the window's pixel format makes every blit a plain copy
+        if pygame.display.get_surface() is not None:
+            return atlas.convert_alpha()
+        return atlas
+
+    def Blit(self, target: pygame.Surface, color: int, piece_type: int, dest) -> None:
+        '''
+        Draws the sprite of a piece, color being 1 for white and 0 for black like the rest of the rules code
+        '''
+        atlas = self.Atlas()
+        target.blit(atlas, dest, self.rects[(1 - color) * COLUMNS + piece_type])
@@ -0,0 +1,110 @@
+'''
+Fixed-size transposition table for the search.
+
+Entries live in two preallocated arrays of 64 bit words (the key, and the
+packed depth/bound/score/move/age), grouped in buckets of four that share
+a hash slot, so memory is decided once when the table is made and never
+grows however long a session runs.
+'''
+from array import array
+from typing import NamedTuple, Optional
+
+BOUND_EXACT = 0
+# the score is at least this much (the search failed high)
+BOUND_LOWER = 1
+# the score is at most this much (no move raised alpha)
+BOUND_UPPER = 2
+
+BUCKET_SIZE = 4
+ENTRY_BYTES = 16
+# scores are stored shifted so they are never negative
+SCORE_OFFSET = 1 << 20
+
+
+class TableEntry(NamedTuple):
+    depth: int
+    bound: int
+    score: int
+    move: int
+
+
+def _pack(depth: int, bound: int, score: int, move: int, age: int) -> int:
+    # move: 18 bits, score: 21 bits, depth: 8 bits, bound: 2 bits, age: 8 bits
+    return move | (score + SCORE_OFFSET) << 18 | depth << 39 | bound << 47 | age << 49
+
+
+class TranspositionTable:
+    def __init__(self, size_mb: float = 16) -> None:
+        entries = max(int(size_mb * (1 << 20)) // ENTRY_BYTES, BUCKET_SIZE)
+        self.buckets = entries // BUCKET_SIZE
+        self.keys = array('Q', bytes(8 * self.buckets * BUCKET_SIZE))
+        self.data = array('Q', bytes(8 * self.buckets * BUCKET_SIZE))
+        self.age = 0
+
+    def new_search(self) -> None:
+        '''
+        Marks everything stored so far as older than what comes next,
+        old entries are the first to be replaced
+        '''
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self) -> None:
+        for index in range(len(self.keys)):
+            self.keys[index] = 0
+            self.data[index] = 0
+        self.age = 0
+
+    def probe(self, key: int) -> Optional[TableEntry]:
+        start = (key % self.buckets) * BUCKET_SIZE
+        keys = self.keys
+        for index in range(start, start + BUCKET_SIZE):
+            if keys[index] == key:
+                data = self.data[index]
+                return TableEntry(data >> 39 & 0xFF, data >> 47 & 3,
+                                  (data >> 18 & 0x1FFFFF) - SCORE_OFFSET, data & 0x3FFFF)
+        return None
+
+    def store(self, key: int, depth: int, bound: int, score: int, move: int) -> None:
+        '''
+        Stores a search result, replacing in order of preference the same
+        position, an empty slot, or the entry that is oldest and shallowest
+        '''
+        start = (key % self.buckets) * BUCKET_SIZE
+        keys = self.keys
+        data = self.data
+        age = self.age
+        depth = min(max(depth, 0), 0xFF)
+
+        replace = start
+        replace_worth = None
+        for index in range(start, start + BUCKET_SIZE):
+            if keys[index] == key:
+                old = data[index]
+                # keep a deeper result from this search unless the new one is exact
+                if bound != BOUND_EXACT and old >> 49 == age and old >> 39 & 0xFF > depth:
+                    return
+                if move == 0:
+                    # don't forget the best move just because this search didn't find one
+                    move = old & 0x3FFFF
+                replace = index
+                break
+            if keys[index] == 0:
+                replace = index
+                break
+            old = data[index]
+            # entries from earlier searches count as much shallower than they are
+            worth = (old >> 39 & 0xFF) - 8 * ((age - (old >> 49)) & 0xFF)
+            if replace_worth is None or worth < replace_worth:
+                replace = index
+                replace_worth = worth
+
+        keys[replace] = key
+        data[replace] = _pack(depth, bound, score, move, age)
+
+    def hashfull(self) -> int:
+        '''
+        Per mille of the first thousand entries used by the current search
+        '''
+        sample = min(1000, len(self.keys))
+        used = sum(1 for index in range(sample) if self.keys[index] and self.data[index] >> 49 == self.age)
+        return used * 1000 // sample
@@ -0,0 +1,265 @@
+'''
+Move generation facts for many positions at once, with NumPy.
+
+A batch of N positions is stacked into uint64 bitboard arrays, and attack
+sets, check status and legal move counts are worked out for all of them
+together with shifts and Kogge-Stone ray fills, so the Python overhead is
+paid per batch instead of per position. The counts are exact: pins, double
+checks, castling through attacked squares and en passant that uncovers the
+king are all handled, giving the same numbers as generate_moves (and so the
+sum of MoveManager.LegalMoves over the pieces of the side to move).
+
+    batch = stack([ChessParser.TranslateFen(fen) for fen in fens])
+    counts, checks = legal_move_counts(batch), in_check(batch)
+'''
+from typing import Iterable, NamedTuple
+import numpy as np
+from bitboard import Position, KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN
+from movegen import CASTLES, PROMOTION_RANK
+
+U64 = np.uint64
+FULL = U64(0xFFFFFFFFFFFFFFFF)
+FILE_A = 0x0101010101010101
+NOT_FILE_A = U64(~FILE_A & 0xFFFFFFFFFFFFFFFF)
+NOT_FILE_H = U64(~(FILE_A << 7) & 0xFFFFFFFFFFFFFFFF)
+NOT_FILE_AB = U64(~(FILE_A | FILE_A << 1) & 0xFFFFFFFFFFFFFFFF)
+NOT_FILE_GH = U64(~(FILE_A << 6 | FILE_A << 7) & 0xFFFFFFFFFFFFFFFF)
+
+# (shift, mask of the squares that can be landed on without wrapping round the board)
+ROOK_DIRECTIONS = ((-8, FULL), (8, FULL), (1, NOT_FILE_A), (-1, NOT_FILE_H))
+BISHOP_DIRECTIONS = ((-9, NOT_FILE_H), (-7, NOT_FILE_A), (7, NOT_FILE_H), (9, NOT_FILE_A))
+KNIGHT_STEPS = ((-17, NOT_FILE_H), (-15, NOT_FILE_A), (-10, NOT_FILE_GH), (-6, NOT_FILE_AB),
+                (6, NOT_FILE_GH), (10, NOT_FILE_AB), (15, NOT_FILE_H), (17, NOT_FILE_A))
+KING_STEPS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+# indexed by color, white pawns go up the board towards a8
+PAWN_FORWARD = (8, -8)
+PAWN_CAPTURES = (((7, NOT_FILE_H), (9, NOT_FILE_A)), ((-9, NOT_FILE_H), (-7, NOT_FILE_A)))
+# the rank a pawn lands on with a single push from its starting rank
+PUSHED_ONCE_RANK = (U64(0xFF << 16), U64(0xFF << 40))
+PROMOTION_RANKS = (U64(PROMOTION_RANK[0]), U64(PROMOTION_RANK[1]))
+
+
+class PositionBatch(NamedTuple):
+    pieces: np.ndarray      # uint64 [N, 2, 6], bitboard of every color and piece type
+    turn: np.ndarray        # int8 [N], 1 for white to move
+    castling: np.ndarray    # uint8 [N], KQkq bits as in Position.castling
+    en_passant: np.ndarray  # int8 [N], square or -1
+
+
+def stack(positions: Iterable[Position]) -> PositionBatch:
+    positions = list(positions)
+    pieces = np.zeros((len(positions), 2, 6), dtype=U64)
+    for index, position in enumerate(positions):
+        for color in range(2):
+            for piece_type in range(6):
+                pieces[index, color, piece_type] = position.colors[color] & position.pieces[piece_type]
+    return PositionBatch(
+        pieces,
+        np.array([position.turn for position in positions], dtype=np.int8),
+        np.array([position.castling for position in positions], dtype=np.uint8),
+        np.array([position.en_passant for position in positions], dtype=np.int8),
+    )
+
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(bitboards: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(bitboards).astype(np.int64)
+else:
+    def popcount(bitboards: np.ndarray) -> np.ndarray:
+        x = bitboards - ((bitboards >> U64(1)) & U64(0x5555555555555555))
+        x = (x & U64(0x3333333333333333)) + ((x >> U64(2)) & U64(0x3333333333333333))
+        x = (x + (x >> U64(4))) & U64(0x0F0F0F0F0F0F0F0F)
+        return ((x * U64(0x0101010101010101)) >> U64(56)).astype(np.int64)
+
+def shift(bitboards: np.ndarray, amount: int) -> np.ndarray:
+    if amount > 0:
+        return bitboards << U64(amount)
+    return bitboards >> U64(-amount)
+
+def step(bitboards: np.ndarray, amount: int, mask: np.uint64) -> np.ndarray:
+    return shift(bitboards, amount) & mask
+
+def ray_fill(sliders: np.ndarray, occupied: np.ndarray, amount: int, mask: np.uint64) -> np.ndarray:
+    '''
+    Squares the sliders reach going one way, up to and including the first piece in the way
+    '''
+    generated = sliders
+    propagate = ~occupied & mask
+    generated = generated | (propagate & shift(generated, amount))
+    propagate = propagate & shift(propagate, amount)
+    generated = generated | (propagate & shift(generated, 2 * amount))
+    propagate = propagate & shift(propagate, 2 * amount)
+    generated = generated | (propagate & shift(generated, 4 * amount))
+    return shift(generated, amount) & mask
+
+def _attacks(pieces: np.ndarray, color: int, occupied: np.ndarray) -> np.ndarray:
+    '''
+    Everything the [N, 6] pieces of color attack
+    '''
+    attacked = np.zeros(len(occupied), dtype=U64)
+    for amount, mask in PAWN_CAPTURES[color]:
+        attacked |= step(pieces[:, PAWN], amount, mask)
+    for amount, mask in KNIGHT_STEPS:
+        attacked |= step(pieces[:, KNIGHT], amount, mask)
+    for amount, mask in KING_STEPS:
+        attacked |= step(pieces[:, KING], amount, mask)
+    rooks = pieces[:, ROOK] | pieces[:, QUEEN]
+    for amount, mask in ROOK_DIRECTIONS:
+        attacked |= ray_fill(rooks, occupied, amount, mask)
+    bishops = pieces[:, BISHOP] | pieces[:, QUEEN]
+    for amount, mask in BISHOP_DIRECTIONS:
+        attacked |= ray_fill(bishops, occupied, amount, mask)
+    return attacked
+
+def attack_sets(batch: PositionBatch) -> np.ndarray:
+    '''
+    uint64 [N, 2]: the squares black (0) and white (1) attack
+    '''
+    occupied = np.bitwise_or.reduce(batch.pieces.reshape(len(batch.turn), 12), axis=1)
+    return np.stack([_attacks(batch.pieces[:, color], color, occupied) for color in range(2)], axis=1)
+
+def _king_attackers(us: int, king: np.ndarray, enemy: np.ndarray, occupied: np.ndarray) -> np.ndarray:
+    '''
+    The enemy pieces attacking the king square, with the given occupancy
+    '''
+    attackers = np.zeros(len(king), dtype=U64)
+    # an enemy pawn attacks the king from where a pawn of ours on the king square would attack
+    for amount, mask in PAWN_CAPTURES[us]:
+        attackers |= step(king, amount, mask) & enemy[:, PAWN]
+    for amount, mask in KNIGHT_STEPS:
+        attackers |= step(king, amount, mask) & enemy[:, KNIGHT]
+    rooks = enemy[:, ROOK] | enemy[:, QUEEN]
+    for amount, mask in ROOK_DIRECTIONS:
+        attackers |= ray_fill(king, occupied, amount, mask) & rooks
+    bishops = enemy[:, BISHOP] | enemy[:, QUEEN]
+    for amount, mask in BISHOP_DIRECTIONS:
+        attackers |= ray_fill(king, occupied, amount, mask) & bishops
+    return attackers
+
+def _split(batch: PositionBatch):
+    '''
+    Rows of the batch by side to move, with our and their pieces as [n, 6] arrays
+    '''
+    for us in (0, 1):
+        rows = np.flatnonzero(batch.turn == us)
+        if len(rows):
+            yield us, rows, batch.pieces[rows, us], batch.pieces[rows, 1 - us]
+
+def in_check(batch: PositionBatch) -> np.ndarray:
+    '''
+    bool [N]: whether the side to move is in check
+    '''
+    result = np.zeros(len(batch.turn), dtype=bool)
+    for us, rows, own, enemy in _split(batch):
+        occupied = np.bitwise_or.reduce(own, axis=1) | np.bitwise_or.reduce(enemy, axis=1)
+        result[rows] = _king_attackers(us, own[:, KING], enemy, occupied) != 0
+    return result
+
+def _count(moves: np.ndarray, promotion_rank: np.uint64) -> np.ndarray:
+    # a pawn move onto the last rank is four moves, one per promotion piece
+    return popcount(moves) + 3 * popcount(moves & promotion_rank)
+
+def _legal_move_counts(us: int, own: np.ndarray, enemy: np.ndarray, castling: np.ndarray,
+                       en_passant: np.ndarray) -> np.ndarray:
+    own_all = np.bitwise_or.reduce(own, axis=1)
+    enemy_all = np.bitwise_or.reduce(enemy, axis=1)
+    occupied = own_all | enemy_all
+    king = own[:, KING]
+    zero = np.zeros(len(king), dtype=U64)
+
+    checkers = _king_attackers(us, king, enemy, occupied)
+    check_count = popcount(checkers)
+    # with one checker the other pieces must take it or step in between, a slider's ray from the king does both
+    blocks = zero.copy()
+    pinned = zero.copy()
+    pins = []
+    for directions, sliders in ((ROOK_DIRECTIONS, enemy[:, ROOK] | enemy[:, QUEEN]),
+                                (BISHOP_DIRECTIONS, enemy[:, BISHOP] | enemy[:, QUEEN])):
+        for amount, mask in directions:
+            ray = ray_fill(king, occupied, amount, mask)
+            blocks |= np.where(ray & sliders != 0, ray, zero)
+            blocker = ray & own_all
+            through = ray_fill(king, occupied ^ blocker, amount, mask)
+            pinned_here = np.where((blocker != 0) & (through & sliders != 0), blocker, zero)
+            pinned |= pinned_here
+            pins.append((amount, pinned_here, through))
+    check_mask = np.where(check_count == 0, FULL, np.where(check_count == 1, blocks | checkers, zero))
+    target = ~own_all & check_mask
+    free = own & ~pinned[:, None]
+
+    counts = np.zeros(len(king), dtype=np.int64)
+    for amount, mask in KNIGHT_STEPS:
+        counts += popcount(step(free[:, KNIGHT], amount, mask) & target)
+    rooks = free[:, ROOK] | free[:, QUEEN]
+    for amount, mask in ROOK_DIRECTIONS:
+        counts += popcount(ray_fill(rooks, occupied, amount, mask) & target)
+    bishops = free[:, BISHOP] | free[:, QUEEN]
+    for amount, mask in BISHOP_DIRECTIONS:
+        counts += popcount(ray_fill(bishops, occupied, amount, mask) & target)
+
+    forward = PAWN_FORWARD[us]
+    promotion_rank = PROMOTION_RANKS[us]
+    empty = ~occupied
+
+    def pawn_moves(pawns: np.ndarray, capture_mask: np.ndarray) -> np.ndarray:
+        single = shift(pawns, forward) & empty
+        double = shift(single & PUSHED_ONCE_RANK[us], forward) & empty
+        total = _count(single & check_mask, promotion_rank) + popcount(double & check_mask)
+        for amount, mask in PAWN_CAPTURES[us]:
+            total += _count(step(pawns, amount, mask) & enemy_all & check_mask & capture_mask, promotion_rank)
+        return total
+
+    counts += pawn_moves(free[:, PAWN], FULL)
+
+    # a pinned piece can only move along the line between its king and the pinner
+    for amount, pinned_here, through in pins:
+        if amount in (-8, 8):
+            counts += popcount(through & target) * ((pinned_here & (own[:, ROOK] | own[:, QUEEN])) != 0)
+            counts += pawn_moves(pinned_here & own[:, PAWN], zero)
+        elif amount in (1, -1):
+            counts += popcount(through & target) * ((pinned_here & (own[:, ROOK] | own[:, QUEEN])) != 0)
+        else:
+            counts += popcount(through & target) * ((pinned_here & (own[:, BISHOP] | own[:, QUEEN])) != 0)
+            pawns = pinned_here & own[:, PAWN]
+            for capture_amount, mask in PAWN_CAPTURES[us]:
+                counts += _count(step(pawns, capture_amount, mask) & enemy_all & through & check_mask, promotion_rank)
+
+    # the king can't step onto a square that's attacked once it's no longer in the way
+    danger = _attacks(enemy, 1 - us, occupied ^ king)
+    for amount, mask in KING_STEPS:
+        counts += popcount(step(king, amount, mask) & ~own_all & ~danger)
+
+    for right, _, _, must_be_empty, crossed in CASTLES[us]:
+        crossed_mask = U64(sum(1 << square for square in crossed))
+        allowed = ((castling & right) != 0) & (check_count == 0)
+        allowed &= (occupied & U64(must_be_empty)) == 0
+        allowed &= (danger & crossed_mask) == 0
+        counts += allowed
+
+    # en passant is played out on the board, taking two pawns off one rank can uncover the king
+    has_en_passant = en_passant >= 0
+    if has_en_passant.any():
+        square = np.where(has_en_passant, en_passant, 0).astype(U64)
+        target_bit = np.where(has_en_passant, U64(1) << square, zero)
+        captured = shift(target_bit, -forward)
+        capturers = zero.copy()
+        for amount, mask in PAWN_CAPTURES[1 - us]:
+            capturers |= step(target_bit, amount, mask)
+        capturers &= own[:, PAWN]
+        first = capturers & (~capturers + U64(1))
+        enemy_after = enemy.copy()
+        enemy_after[:, PAWN] &= ~captured
+        for capturer in (first, capturers ^ first):
+            after = occupied ^ capturer ^ captured ^ target_bit
+            attacked = _king_attackers(us, king, enemy_after, after)
+            counts += (capturer != 0) & (attacked == 0)
+    return counts
+
+def legal_move_counts(batch: PositionBatch) -> np.ndarray:
+    '''
+    int64 [N]: number of legal moves of the side to move, promotions counted once per piece
+    '''
+    result = np.zeros(len(batch.turn), dtype=np.int64)
+    for us, rows, own, enemy in _split(batch):
+        result[rows] = _legal_move_counts(us, own, enemy, batch.castling[rows], batch.en_passant[rows])
+    return result
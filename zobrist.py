@@ -0,0 +1,19 @@
+'''
+Zobrist keys for positions.
+
+The random numbers come from a fixed seed so every process (and every run)
+gives the same key to the same position, which keeps keys usable across
+worker processes and in files written to disk.
+'''
+import random
+
+_random = random.Random(0x5EED_C4E55)
+
+# indexed by color * 6 + piece_type, then square
+PIECE_KEYS = [[_random.getrandbits(64) for _ in range(64)] for _ in range(12)]
+# one key per combination of castling rights, so changing rights is a single xor
+CASTLING_KEYS = [_random.getrandbits(64) for _ in range(16)]
+# indexed by the file of the en passant square
+EN_PASSANT_KEYS = [_random.getrandbits(64) for _ in range(8)]
+# xored in when black is to move
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)